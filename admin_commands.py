@@ -1,22 +1,71 @@
+import asyncio
+import html
+import io
 import logging
 import json
 import os
-import sqlite3
 from datetime import datetime
-from telegram import Update, MenuButtonCommands
-from telegram.ext import ContextTypes, CommandHandler
-from announcement import send_global_announcement
+from telegram import Update, MenuButtonCommands, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from announcement import BroadcastJobExists, new_job_id, start_global_announcement, schedule_broadcast_job, get_live_progress
+from profiling import MAX_PROFILE_SECONDS, is_profiling, profile
 
 
 
 # ⚠️ ЗАМЕНИТЕ ЭТОТ ID НА СВОЙ! ⚠️
 ADMIN_IDS = [1302211108]
 
+JOB_STATUS_NAMES = {
+    'running': '▶️ идет',
+    'paused': '⏸ на паузе',
+    'cancelled': '⏹ отменена',
+    'done': '✅ завершена',
+}
+
+# Пользователей на одной странице /list_users: страница должна уместиться
+# в одно сообщение (4096 символов) даже с длинными экранированными именами
+USERS_PAGE_SIZE = 10
+USERS_NAME_LENGTH = 40
+USERS_CALLBACK_PREFIX = "users_"
+
+OPERATION_NAMES = {
+    'addition': '➕ Сложение',
+    'subtraction': '➖ Вычитание',
+    'multiplication': '✖️ Умножение',
+    'division': '➗ Деление',
+}
+
 def is_admin(user_id):
     """Проверяет, является ли пользователь администратором"""
     return user_id in ADMIN_IDS
 
 
+def parse_audience_args(args):
+    """Отделяет фильтры аудитории active_since=ГГГГ-ММ-ДД и min_questions=N от текста
+
+    Возвращает (фильтры, оставшиеся аргументы); ValueError при неверном значении.
+    """
+    filters = {}
+    args = list(args)
+    while args and '=' in args[0] and args[0].split('=', 1)[0] in ('active_since', 'min_questions'):
+        key, value = args.pop(0).split('=', 1)
+        if key == 'active_since':
+            filters[key] = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+        else:
+            filters[key] = int(value)
+    return filters, args
+
+
+def format_operation_stats(operation_stats):
+    """Строки отчета с точностью по операциям"""
+    text = ""
+    for operation_type, total, correct in operation_stats:
+        accuracy = round((correct / total) * 100, 2) if total > 0 else 0
+        name = OPERATION_NAMES.get(operation_type, operation_type)
+        text += f"• {name}: {total} вопросов ({accuracy}%)\n"
+    return text
+
+
 
 
 async def announce(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -27,21 +76,31 @@ async def announce(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    if not context.args:
+    try:
+        filters, args = parse_audience_args(context.args)
+    except ValueError:
+        await update.message.reply_text("❌ Неверный фильтр: active_since=ГГГГ-ММ-ДД, min_questions=число")
+        return
+    
+    if not args:
         await update.message.reply_text(
-            "Использование: /announce <текст>\n\n"
+            "Использование: /announce [active_since=ГГГГ-ММ-ДД] [min_questions=N] <текст>\n\n"
             "Пример: /announce Привет всем! Мы добавили новые задания! 🎉"
         )
         return
     
     # Простое текстовое объявление
-    message_text = " ".join(context.args)
+    message_text = " ".join(args)
     message_text = f"📢 <b>Объявление от администратора:</b>\n\n{message_text}"
     
     try:
-        await update.message.reply_text("🔄 Начинаю рассылку...")
-        await send_global_announcement(context, message_text)
-        await update.message.reply_text("✅ Объявление отправлено всем пользователям!")
+        job_id = await start_global_announcement(context, message_text, created_by=user_id, **filters)
+        await update.message.reply_text(
+            f"🔄 Рассылка запущена в фоне.\n\nID: {job_id}\n"
+            f"Прогресс: /broadcast_status {job_id}"
+        )
+    except BroadcastJobExists as e:
+        await update.message.reply_text(f"❌ Рассылка с ID {e} уже существует, повторите команду")
     except Exception as e:
         logging.error(f"Ошибка при рассылке: {e}")
         await update.message.reply_text("❌ Ошибка при отправке объявления")
@@ -55,73 +114,141 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    if not context.args:
-        await update.message.reply_text("Использование: /broadcast <текст>")
+    try:
+        filters, args = parse_audience_args(context.args)
+    except ValueError:
+        await update.message.reply_text("❌ Неверный фильтр: active_since=ГГГГ-ММ-ДД, min_questions=число")
+        return
+    
+    if not args:
+        await update.message.reply_text(
+            "Использование: /broadcast [active_since=ГГГГ-ММ-ДД] [min_questions=N] <текст>"
+        )
         return
     
-    message_text = " ".join(context.args)
+    message_text = " ".join(args)
     message_text = f"📢 <b>Объявление:</b>\n\n{message_text}"
     
     try:
-        await update.message.reply_text("🔄 Начинаю рассылку...")
-        await send_global_announcement(context, message_text, announcement_id=f"quick_{user_id}_{datetime.now().strftime('%H%M%S')}")
-        await update.message.reply_text("✅ Объявление отправлено!")
+        job_id = await start_global_announcement(
+            context, message_text,
+            announcement_id=new_job_id(f"quick_{user_id}"),
+            created_by=user_id,
+            **filters
+        )
+        await update.message.reply_text(
+            f"🔄 Рассылка запущена в фоне.\n\nID: {job_id}\n"
+            f"Прогресс: /broadcast_status {job_id}"
+        )
+    except BroadcastJobExists as e:
+        await update.message.reply_text(f"❌ Рассылка с ID {e} уже существует, повторите команду")
     except Exception as e:
         logging.error(f"Ошибка при рассылке: {e}")
         await update.message.reply_text("❌ Ошибка при отправке")
 
-async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает подробную статистику бота - ТО САМАЯ КОМАНДА ДЛЯ СТАТИСТИКИ!"""
+async def format_job(context: ContextTypes.DEFAULT_TYPE, job):
+    """Описание задания рассылки с текущими счетчиками"""
+    announcement_manager = context.bot_data['announcements']
+    sent, failed = get_live_progress(context, job)
+    remaining = 0
+    if job['status'] in ('running', 'paused'):
+        remaining = await asyncio.to_thread(
+            announcement_manager.count_pending_recipients, job['job_id'], job['cursor'],
+            job['active_since'], job['min_questions']
+        )
+    status = JOB_STATUS_NAMES.get(job['status'], job['status'])
+    return (
+        f"<b>{job['job_id']}</b> - {status}\n"
+        f"   Отправлено: {sent} | Ошибок: {failed} | Осталось: {remaining}\n"
+    )
+
+
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Состояние рассылок: одной по ID или последних пяти"""
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    from database import Database
-    db = Database()
+    announcement_manager = context.bot_data['announcements']
+    if context.args:
+        job = await asyncio.to_thread(announcement_manager.get_job, context.args[0])
+        jobs = [job] if job else []
+    else:
+        jobs = await asyncio.to_thread(announcement_manager.list_jobs, 5)
     
-    conn = sqlite3.connect('math_bot.db')
-    cursor = conn.cursor()
+    if not jobs:
+        await update.message.reply_text("📭 Рассылки не найдены")
+        return
     
-    # Статистика по пользователям
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
+    text = "📨 <b>Рассылки:</b>\n\n"
+    for job in jobs:
+        text += await format_job(context, job)
+    await update.message.reply_text(text, parse_mode='HTML')
+
+
+async def change_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                           status, from_statuses, done_text):
+    """Общая часть команд паузы, продолжения и отмены рассылки"""
+    user_id = update.effective_user.id
     
-    cursor.execute('SELECT COUNT(*) FROM users WHERE total_questions > 0')
-    active_users = cursor.fetchone()[0]
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда только для администраторов!")
+        return False
     
-    cursor.execute('SELECT COUNT(*) FROM users WHERE total_questions = 0')
-    new_users = cursor.fetchone()[0]
+    if not context.args:
+        await update.message.reply_text("Использование: укажите ID рассылки, список - /broadcast_status")
+        return False
+    
+    job_id = context.args[0]
+    changed = await asyncio.to_thread(
+        context.bot_data['announcements'].set_job_status, job_id, status, from_statuses
+    )
+    if changed:
+        await update.message.reply_text(f"{done_text}: {job_id}")
+    else:
+        await update.message.reply_text("❌ Рассылка не найдена или уже в другом состоянии")
+    return changed
+
+
+async def broadcast_pause(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ставит рассылку на паузу"""
+    await change_broadcast(update, context, 'paused', ('running',), "⏸ Рассылка приостановлена")
+
+
+async def broadcast_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Продолжает приостановленную рассылку"""
+    if await change_broadcast(update, context, 'running', ('paused',), "▶️ Рассылка продолжена"):
+        schedule_broadcast_job(context.application, context.args[0])
+
+
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отменяет рассылку"""
+    await change_broadcast(update, context, 'cancelled', ('running', 'paused'), "⏹ Рассылка отменена")
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает подробную статистику бота - ТО САМАЯ КОМАНДА ДЛЯ СТАТИСТИКИ!"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда только для администраторов!")
+        return
     
-    # Общая статистика по ответам
-    cursor.execute('SELECT SUM(total_questions), SUM(correct_answers) FROM users')
-    result = cursor.fetchone()
-    total_questions = result[0] or 0
-    total_correct = result[1] or 0
+    db = context.bot_data['db']
     
-    # Точность
-    accuracy = round((total_correct / total_questions) * 100, 2) if total_questions > 0 else 0
+    # Статистика по пользователям и общая статистика по ответам
+    summary = await db.get_summary_stats()
     
     # Самые активные пользователи
-    cursor.execute('''
-        SELECT first_name, total_questions, correct_answers 
-        FROM users 
-        WHERE total_questions > 0 
-        ORDER BY total_questions DESC 
-        LIMIT 5
-    ''')
-    top_users = cursor.fetchall()
+    top_users = await db.get_top_users(5)
     
     # Статистика по датам (последние 7 дней)
-    cursor.execute('''
-        SELECT DATE(created_at) as date, COUNT(*) as new_users
-        FROM users 
-        WHERE created_at >= date('now', '-7 days')
-        GROUP BY DATE(created_at)
-        ORDER BY date DESC
-    ''')
-    recent_users = cursor.fetchall()
+    recent_users = await db.get_recent_registrations(7)
+    
+    # Точность по типам операций
+    operation_stats = await db.get_operation_stats()
     
     # Формируем красивый отчет
     stats_text = f"""
@@ -129,14 +256,14 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ━━━━━━━━━━━━━━━━━━━━
 
 👥 <b>Пользователи:</b>
-• Всего пользователей: <b>{total_users}</b>
-• Активных (отвечали): <b>{active_users}</b>
-• Новых (еще не играли): <b>{new_users}</b>
+• Всего пользователей: <b>{summary['total_users']}</b>
+• Активных (отвечали): <b>{summary['active_users']}</b>
+• Новых (еще не играли): <b>{summary['new_users']}</b>
 
 🎯 <b>Общая активность:</b>
-• Всего вопросов: <b>{total_questions}</b>
-• Правильных ответов: <b>{total_correct}</b>
-• Общая точность: <b>{accuracy}%</b>
+• Всего вопросов: <b>{summary['total_questions']}</b>
+• Правильных ответов: <b>{summary['total_correct']}</b>
+• Общая точность: <b>{summary['accuracy']}%</b>
 
 """
     
@@ -147,6 +274,11 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_accuracy = round((correct / total) * 100, 2) if total > 0 else 0
             stats_text += f"{i}. {name}: {total} вопросов ({user_accuracy}%)\n"
     
+    # Добавляем точность по операциям
+    if operation_stats:
+        stats_text += "\n🧮 <b>По операциям:</b>\n"
+        stats_text += format_operation_stats(operation_stats)
+    
     # Добавляем статистику по дням
     if recent_users:
         stats_text += "\n📈 <b>Новые пользователи по дням:</b>\n"
@@ -156,43 +288,25 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     stats_text += f"\n⏰ <b>Последнее обновление:</b>\n{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     
     await update.message.reply_text(stats_text, parse_mode='HTML')
-    conn.close()
-    async def quick_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
+
+async def rebuild_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пересчитывает агрегированную статистику с нуля и сверяет со счетчиками"""
+    user_id = update.effective_user.id
     
     if not is_admin(user_id):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    conn = sqlite3.connect('math_bot.db')
-    cursor = conn.cursor()
+    before, after = await context.bot_data['db'].rebuild_counters()
     
-    # Основные метрики
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM users WHERE total_questions > 0')
-    active_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT SUM(total_questions), SUM(correct_answers) FROM users')
-    result = cursor.fetchone()
-    total_questions = result[0] or 0
-    total_correct = result[1] or 0
-    
-    accuracy = round((total_correct / total_questions) * 100, 2) if total_questions > 0 else 0
-    
-    quick_text = f"""
-📊 <b>Быстрая статистика:</b>
-
-👥 Пользователи: {total_users}
-🎮 Активных: {active_users}
-❓ Вопросов: {total_questions}
-✅ Правильно: {total_correct}
-🎯 Точность: {accuracy}%
-    """
-    
-    await update.message.reply_text(quick_text, parse_mode='HTML')
-    conn.close()
+    if before == after:
+        await update.message.reply_text("✅ Счетчики пересчитаны, расхождений нет")
+    else:
+        diff = "\n".join(
+            f"• {key}: {before[key]} → {after[key]}"
+            for key in after if before[key] != after[key]
+        )
+        await update.message.reply_text(f"⚠️ Счетчики пересчитаны, найдены расхождения:\n{diff}")
 
 async def user_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика по конкретному пользователю"""
@@ -205,21 +319,14 @@ async def user_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args:
         # Если передан username или ID
         target = context.args[0]
-        conn = sqlite3.connect('math_bot.db')
-        cursor = conn.cursor()
         
         # Пробуем найти по ID или username
-        cursor.execute('''
-            SELECT user_id, username, first_name, last_name, total_questions, correct_answers, created_at
-            FROM users 
-            WHERE user_id = ? OR username = ?
-        ''', (target, target.replace('@', '')))
-        
-        user_data = cursor.fetchone()
+        user_data = await context.bot_data['db'].find_user(target)
         
         if user_data:
             user_id, username, first_name, last_name, total, correct, created_at = user_data
             accuracy = round((correct / total) * 100, 2) if total > 0 else 0
+            operation_stats = await context.bot_data['db'].get_user_operation_stats(user_id)
             
             user_text = f"""
 👤 <b>Статистика пользователя:</b>
@@ -233,11 +340,11 @@ ID: {user_id}
 ✅ Правильных: {correct}
 🎯 Точность: {accuracy}%
             """
+            if operation_stats:
+                user_text += "\n🧮 <b>По операциям:</b>\n" + format_operation_stats(operation_stats)
             await update.message.reply_text(user_text, parse_mode='HTML')
         else:
             await update.message.reply_text("❌ Пользователь не найден")
-        
-        conn.close()
     else:
         await update.message.reply_text("Использование: /user_stats <id или username>")
 
@@ -249,32 +356,18 @@ async def quick_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    conn = sqlite3.connect('math_bot.db')
-    cursor = conn.cursor()
-    
     try:
         # Основные метрики
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE total_questions > 0')
-        active_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(total_questions), SUM(correct_answers) FROM users')
-        result = cursor.fetchone()
-        total_questions = result[0] or 0
-        total_correct = result[1] or 0
-        
-        accuracy = round((total_correct / total_questions) * 100, 2) if total_questions > 0 else 0
+        summary = await context.bot_data['db'].get_summary_stats()
         
         quick_text = f"""
 📊 <b>Быстрая статистика:</b>
 
-👥 Пользователи: {total_users}
-🎮 Активных: {active_users}
-❓ Вопросов: {total_questions}
-✅ Правильно: {total_correct}
-🎯 Точность: {accuracy}%
+👥 Пользователи: {summary['total_users']}
+🎮 Активных: {summary['active_users']}
+❓ Вопросов: {summary['total_questions']}
+✅ Правильно: {summary['total_correct']}
+🎯 Точность: {summary['accuracy']}%
         """
         
         await update.message.reply_text(quick_text, parse_mode='HTML')
@@ -282,67 +375,146 @@ async def quick_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logging.error(f"Ошибка при получении статистики: {e}")
         await update.message.reply_text("❌ Ошибка при получении статистики")
-    
-    finally:
-        conn.close()
+
+
+def users_page_callback(direction, row, page):
+    """callback_data кнопки перехода: направление, ключ крайней строки и номер страницы"""
+    user_id, created_at = row[0], row[6]
+    return f"{USERS_CALLBACK_PREFIX}{direction}|{created_at}|{user_id}|{page}"
+
+
+async def render_users_page(db, cursor=None, newer=False, page=1):
+    """Текст и клавиатура одной страницы списка пользователей"""
+    rows = await db.list_users(cursor, newer, USERS_PAGE_SIZE)
+    if not rows and cursor is not None:
+        # Страница опустела (например, пользователей удалили) - возвращаемся к началу
+        return await render_users_page(db)
+    if not rows:
+        return "📭 В базе нет пользователей", None
+    
+    # Лишняя строка показывает, что в этом направлении есть еще страница
+    has_more = len(rows) > USERS_PAGE_SIZE
+    if has_more:
+        rows = rows[1:] if newer else rows[:-1]
+    if cursor is None:
+        has_newer, has_older = False, has_more
+    elif newer:
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = True, has_more
+    
+    users_text = f"👥 <b>Список пользователей</b> (страница {page}):\n\n"
+    first_number = (page - 1) * USERS_PAGE_SIZE + 1
+    for i, (user_id, username, first_name, last_name, total, correct, created_at) in enumerate(rows, first_number):
+        accuracy = round((correct / total) * 100, 2) if total > 0 else 0
+        name = f"{first_name or ''} {last_name or ''}".strip()[:USERS_NAME_LENGTH]
+        users_text += f"{i}. {html.escape(name)} (@{html.escape(username or 'нет')})\n"
+        users_text += f"   ID: {user_id} | Вопросов: {total} | Точность: {accuracy}%\n"
+        users_text += f"   Зарегистрирован: {(created_at or '')[:10]}\n\n"
+    
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("◀", callback_data=users_page_callback("newer", rows[0], page - 1)))
+    if has_older:
+        buttons.append(InlineKeyboardButton("▶", callback_data=users_page_callback("older", rows[-1], page + 1)))
+    return users_text, InlineKeyboardMarkup([buttons]) if buttons else None
 
 
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Выводит список всех пользователей"""
+    """Выводит первую страницу списка пользователей с кнопками навигации"""
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
         await update.message.reply_text("❌ Эта команда только для администраторов!")
         return
     
-    conn = sqlite3.connect('math_bot.db')
-    
     try:
-        cursor = conn.cursor()
-        
-        # Получаем всех пользователей
-        cursor.execute('''
-            SELECT user_id, username, first_name, last_name, total_questions, correct_answers, created_at
-            FROM users 
-            ORDER BY created_at DESC
-        ''')
-        
-        all_users = cursor.fetchall()
-        
-        if not all_users:
-            await update.message.reply_text("📭 В базе нет пользователей")
-            return
-        
-        users_text = "👥 <b>Список всех пользователей:</b>\n\n"
-        
-        for i, (user_id, username, first_name, last_name, total, correct, created_at) in enumerate(all_users, 1):
-            accuracy = round((correct / total) * 100, 2) if total > 0 else 0
-            users_text += f"{i}. {first_name} {last_name or ''} (@{username or 'нет'})\n"
-            users_text += f"   ID: {user_id} | Вопросов: {total} | Точность: {accuracy}%\n"
-            users_text += f"   Зарегистрирован: {created_at[:10]}\n\n"
-        
-        # Если сообщение слишком длинное, разбиваем на части
-        if len(users_text) > 4000:
-            parts = [users_text[i:i+4000] for i in range(0, len(users_text), 4000)]
-            for part in parts:
-                await update.message.reply_text(part, parse_mode='HTML')
-        else:
-            await update.message.reply_text(users_text, parse_mode='HTML')
+        users_text, keyboard = await render_users_page(context.bot_data['db'])
+        await update.message.reply_text(users_text, parse_mode='HTML', reply_markup=keyboard)
     
     except Exception as e:
         logging.error(f"Ошибка при получении списка пользователей: {e}")
         await update.message.reply_text("❌ Ошибка при получении списка пользователей")
+
+
+async def list_users_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает список пользователей кнопками ◀/▶, редактируя то же сообщение"""
+    query = update.callback_query
+    
+    if not is_admin(update.effective_user.id):
+        await query.answer("❌ Только для администраторов!")
+        return
+    
+    try:
+        direction, created_at, user_id, page = query.data[len(USERS_CALLBACK_PREFIX):].split("|")
+        cursor = (created_at, int(user_id))
+        page = max(1, int(page))
+    except ValueError:
+        await query.answer("Неверные данные кнопки")
+        return
+    
+    await query.answer()
+    try:
+        users_text, keyboard = await render_users_page(
+            context.bot_data['db'], cursor, direction == "newer", page
+        )
+        await query.edit_message_text(users_text, parse_mode='HTML', reply_markup=keyboard)
+    
+    except Exception as e:
+        logging.error(f"Ошибка при получении списка пользователей: {e}")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профилирует процесс N секунд и присылает отчет файлом"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Эта команда только для администраторов!")
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else 10
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        await update.message.reply_text(f"Использование: /profile [секунды от 1 до {MAX_PROFILE_SECONDS}]")
+        return
+    
+    if is_profiling():
+        await update.message.reply_text("⏳ Профилирование уже идет, дождитесь отчета")
+        return
     
-    finally:
-        conn.close()
+    await update.message.reply_text(f"🔬 Профилирую {seconds} с...")
+    
+    async def send_report():
+        try:
+            report = await profile(seconds)
+            filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            await update.message.reply_document(
+                InputFile(io.BytesIO(report.encode()), filename=filename),
+                caption=f"📈 Профиль за {seconds} с: горячие функции и выделения памяти"
+            )
+        except Exception as e:
+            logging.error(f"Ошибка при профилировании: {e}")
+            await update.message.reply_text("❌ Ошибка при профилировании")
+    
+    # Профиль собирается в фоне, обработка обновлений администратора не ждет
+    context.application.create_task(send_report(), update=update)
 
 
 def setup_admin_handlers(application):
     """Добавляет обработчики команд администратора"""
     application.add_handler(CommandHandler("announce", announce))
     application.add_handler(CommandHandler("broadcast", broadcast))
-    application.add_handler(CommandHandler("stats", stats))  # Полная статистика
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status))  # Прогресс рассылок
+    application.add_handler(CommandHandler("broadcast_pause", broadcast_pause))
+    application.add_handler(CommandHandler("broadcast_resume", broadcast_resume))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel))
+    # /stats регистрирует MathBot: для администраторов он вызывает stats()
     application.add_handler(CommandHandler("quick_stats", quick_stats))  # Быстрая статистика
+    application.add_handler(CommandHandler("rebuild_stats", rebuild_stats))  # Пересчет счетчиков
     application.add_handler(CommandHandler("user_stats", user_stats))  # Статистика пользователя
     application.add_handler(CommandHandler("list_users", list_users))
+    application.add_handler(CallbackQueryHandler(list_users_navigation, pattern=f"^{USERS_CALLBACK_PREFIX}"))
+    application.add_handler(CommandHandler("profile", profile_command))  # Профиль процесса
 
@@ -1,143 +1,498 @@
+import asyncio
+import hashlib
 import logging
-import sqlite3
+import secrets
 from telegram import Update, InputFile
-from telegram.ext import ContextTypes
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import CallbackContext, ContextTypes
 import os
 from datetime import datetime
+from database import DB_NAME, get_pool
+from metrics import timed_query
+from broadcast import BroadcastEngine
+from logging_config import OutcomeLog
+
+# Сколько отметок о доставке записывать одной транзакцией
+MARK_BATCH_SIZE = 100
+
+# Сколько получателей задание рассылки обрабатывает между сохранениями курсора
+JOB_PAGE_SIZE = 200
+
+JOB_COLUMNS = ('job_id', 'message_text', 'photo_path', 'status', 'cursor',
+               'sent', 'failed', 'created_by', 'created_at', 'updated_at',
+               'active_since', 'min_questions')
+
+
+def audience_filter(active_since=None, min_questions=None):
+    """Условие выборки аудитории: только доступные пользователи и фильтры рассылки"""
+    conditions = ['u.unreachable_at IS NULL']
+    params = []
+    if active_since:
+        conditions.append('u.last_active_at >= ?')
+        params.append(active_since)
+    if min_questions:
+        conditions.append('u.total_questions >= ?')
+        params.append(min_questions)
+    return ' AND '.join(conditions), params
+
+
+def classify_delivery_error(error):
+    """Причина, по которой пользователь недоступен навсегда, или None для временных ошибок"""
+    if isinstance(error, Forbidden):
+        # Бот заблокирован или аккаунт удален
+        return 'forbidden'
+    if isinstance(error, BadRequest) and 'chat not found' in str(error).lower():
+        return 'chat_not_found'
+    return None
 
 
 class AnnouncementManager:
-    def __init__(self, db_name='math_bot.db'):
+    def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
-        self.init_announcements_table()
+        self.pool = get_pool(db_name)
     
-    def init_announcements_table(self):
-        """Создает таблицу для отслеживания отправленных объявлений"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS announcements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                announcement_id TEXT UNIQUE,
-                user_id INTEGER,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
+    @timed_query
+    def get_all_users(self):
+        """Получает список всех доступных пользователей бота"""
+        cursor = self.pool.connection().execute(
+            'SELECT user_id FROM users WHERE unreachable_at IS NULL'
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    @timed_query
+    def get_pending_recipients(self, announcement_id, after_user_id=0, limit=None,
+                               active_since=None, min_questions=None):
+        """Пользователи, которые еще не получили объявление, одним запросом
+
+        Постранично: после after_user_id, не больше limit штук. Недоступные
+        пользователи пропускаются, active_since и min_questions сужают аудиторию.
+        """
+        condition, params = audience_filter(active_since, min_questions)
+        cursor = self.pool.connection().execute(f'''
+            SELECT user_id FROM users AS u
+            WHERE u.user_id > ? AND {condition} AND NOT EXISTS (
+                SELECT 1 FROM announcement_deliveries AS d
+                WHERE d.announcement_id = ? AND d.user_id = u.user_id
             )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logging.info("Таблица объявлений инициализирована")
+            ORDER BY user_id
+            LIMIT ?
+        ''', (after_user_id, *params, announcement_id, -1 if limit is None else limit))
+        return [row[0] for row in cursor.fetchall()]
     
-    def get_all_users(self):
-        """Получает список всех пользователей бота"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT user_id FROM users')
-        users = [row[0] for row in cursor.fetchall()]
-        
-        conn.close()
-        return users
+    @timed_query
+    def count_pending_recipients(self, announcement_id, after_user_id=0,
+                                 active_since=None, min_questions=None):
+        """Сколько получателей осталось после after_user_id"""
+        condition, params = audience_filter(active_since, min_questions)
+        return self.pool.connection().execute(f'''
+            SELECT COUNT(*) FROM users AS u
+            WHERE u.user_id > ? AND {condition} AND NOT EXISTS (
+                SELECT 1 FROM announcement_deliveries AS d
+                WHERE d.announcement_id = ? AND d.user_id = u.user_id
+            )
+        ''', (after_user_id, *params, announcement_id)).fetchone()[0]
     
-    def mark_announcement_sent(self, user_id, announcement_id):
-        """Отмечает, что объявление отправлено пользователю"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO announcements (announcement_id, user_id)
+    @timed_query
+    def mark_unreachable(self, rows):
+        """Помечает пользователей недоступными: строки (причина, user_id)"""
+        with self.pool.transaction() as conn:
+            conn.executemany('''
+                UPDATE users
+                SET unreachable_at = CURRENT_TIMESTAMP, unreachable_reason = ?
+                WHERE user_id = ?
+            ''', rows)
+    
+    @timed_query
+    def create_job(self, job_id, message_text, photo_path=None, created_by=None,
+                   active_since=None, min_questions=None):
+        """Создает задание рассылки; False, если задание с таким ID уже есть"""
+        with self.pool.transaction() as conn:
+            return conn.execute('''
+                INSERT OR IGNORE INTO broadcast_jobs
+                    (job_id, message_text, photo_path, created_by, active_since, min_questions)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (job_id, message_text, photo_path, created_by, active_since, min_questions)).rowcount == 1
+    
+    @timed_query
+    def get_job(self, job_id):
+        """Задание рассылки в виде словаря или None"""
+        row = self.pool.connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+    
+    @timed_query
+    def list_jobs(self, limit=5):
+        """Последние задания рассылки"""
+        rows = self.pool.connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM broadcast_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+    
+    @timed_query
+    def get_job_ids(self, status):
+        """ID заданий в указанном статусе"""
+        cursor = self.pool.connection().execute(
+            'SELECT job_id FROM broadcast_jobs WHERE status = ?', (status,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    @timed_query
+    def set_job_status(self, job_id, status, from_statuses):
+        """Меняет статус задания, если сейчас он один из from_statuses"""
+        placeholders = ', '.join('?' * len(from_statuses))
+        with self.pool.transaction() as conn:
+            return conn.execute(f'''
+                UPDATE broadcast_jobs
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ? AND status IN ({placeholders})
+            ''', (status, job_id, *from_statuses)).rowcount > 0
+    
+    @timed_query
+    def get_cached_file_id(self, content_hash):
+        """file_id ранее загруженного файла с таким содержимым или None"""
+        row = self.pool.connection().execute(
+            'SELECT file_id FROM media_cache WHERE content_hash = ?', (content_hash,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    @timed_query
+    def cache_file_id(self, content_hash, file_id):
+        """Запоминает file_id загруженного файла"""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO media_cache (content_hash, file_id)
                 VALUES (?, ?)
-            ''', (announcement_id, user_id))
-            
-            conn.commit()
+            ''', (content_hash, file_id))
+    
+    @timed_query
+    def forget_file_id(self, content_hash):
+        """Удаляет file_id, который Telegram больше не принимает"""
+        with self.pool.transaction() as conn:
+            conn.execute('DELETE FROM media_cache WHERE content_hash = ?', (content_hash,))
+    
+    @timed_query
+    def save_job_progress(self, job_id, cursor, sent, failed):
+        """Сохраняет курсор и счетчики задания"""
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                UPDATE broadcast_jobs
+                SET cursor = ?, sent = ?, failed = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            ''', (cursor, sent, failed, job_id))
+    
+    @timed_query
+    def mark_announcements_sent(self, announcement_id, user_ids):
+        """Отмечает доставку объявления пачке пользователей одной транзакцией"""
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany('''
+                    INSERT OR IGNORE INTO announcement_deliveries (announcement_id, user_id)
+                    VALUES (?, ?)
+                ''', [(announcement_id, user_id) for user_id in user_ids])
         except Exception as e:
             logging.error(f"Ошибка при отметке объявления: {e}")
-        finally:
-            conn.close()
     
+    def mark_announcement_sent(self, user_id, announcement_id):
+        """Отмечает, что объявление отправлено пользователю"""
+        self.mark_announcements_sent(announcement_id, [user_id])
+    
+    @timed_query
     def is_announcement_sent(self, user_id, announcement_id):
         """Проверяет, было ли объявление уже отправлено пользователю"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 1 FROM announcements 
-            WHERE user_id = ? AND announcement_id = ?
-        ''', (user_id, announcement_id))
+        cursor = self.pool.connection().execute('''
+            SELECT 1 FROM announcement_deliveries
+            WHERE announcement_id = ? AND user_id = ?
+        ''', (announcement_id, user_id))
         
-        result = cursor.fetchone() is not None
-        conn.close()
-        return result
+        return cursor.fetchone() is not None
 
-async def send_global_announcement(context: ContextTypes.DEFAULT_TYPE, 
-                                 message_text: str, 
-                                 photo_path: str = None,
-                                 announcement_id: str = None):
+def file_sha256(path):
+    """Хэш содержимого файла для кэша file_id"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schedule_broadcast_job(application, job_id):
+    """Запускает задание рассылки фоновой задачей
+
+    Не JobQueue и не Application.create_task: Application.stop() ждет
+    завершения и тех, и других, а рассылка может идти часами. Задачи
+    хранятся в bot_data['broadcast_tasks'] и отменяются в
+    cancel_broadcast_jobs при остановке бота; прогресс сохранен курсором,
+    и после перезапуска рассылка продолжится.
     """
-    Отправляет глобальное объявление всем пользователям бота
+    tasks = application.bot_data.setdefault('broadcast_tasks', {})
+    if job_id in tasks:
+        return
+    context = CallbackContext(application)
+    task = asyncio.get_running_loop().create_task(run_broadcast(context, job_id), name=f"broadcast:{job_id}")
+    tasks[job_id] = task
     
-    Args:
-        context: Контекст бота
-        message_text: Текст объявления
-        photo_path: Путь к картинке (опционально)
-        announcement_id: Уникальный ID объявления (для избежания дублирования)
+    def done(task):
+        tasks.pop(job_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Рассылка {job_id} прервана ошибкой: {task.exception()!r}")
+    
+    task.add_done_callback(done)
+
+
+async def cancel_broadcast_jobs(application):
+    """Прерывает выполняющиеся рассылки; задания остаются в статусе running"""
+    tasks = list(application.bot_data.get('broadcast_tasks', {}).values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def resume_broadcast_jobs(application):
+    """Продолжает задания, прерванные перезапуском бота"""
+    for job_id in application.bot_data['announcements'].get_job_ids('running'):
+        logging.info(f"Продолжаю рассылку {job_id}")
+        schedule_broadcast_job(application, job_id)
+
+
+def get_live_progress(context: ContextTypes.DEFAULT_TYPE, job):
+    """Счетчики задания с учетом еще не сохраненного прогресса выполняющейся рассылки"""
+    live = context.bot_data.get('active_broadcasts', {}).get(job['job_id'])
+    if live is None:
+        return job['sent'], job['failed']
+    return live['sent'] + live['engine'].sent, live['failed'] + live['engine'].failed
+
+
+async def run_broadcast(context: ContextTypes.DEFAULT_TYPE, job_id: str):
     """
+    Выполняет задание рассылки, начиная с сохраненного курсора
     
-    announcement_manager = AnnouncementManager()
-    all_users = announcement_manager.get_all_users()
+    Получатели обрабатываются страницами по JOB_PAGE_SIZE. После каждой
+    страницы курсор и счетчики сохраняются, а статус задания перечитывается,
+    так что пауза и отмена срабатывают на границе страницы.
+    """
+    announcement_manager = context.bot_data['announcements']
+    active = context.bot_data.setdefault('active_broadcasts', {})
+    if job_id in active:
+        return
     
-    if not all_users:
-        logging.info("Нет пользователей для отправки объявления")
+    job = await asyncio.to_thread(announcement_manager.get_job, job_id)
+    if job is None or job['status'] != 'running':
         return
     
-    successful_sends = 0
-    failed_sends = 0
+    message_text = job['message_text']
+    photo_path = job['photo_path']
+    # Отдельный пул соединений для рассылок, если он настроен
+    bot = context.bot_data.get('broadcast_bot', context.bot)
     
-    # Создаем уникальный ID объявления если не предоставлен
-    if announcement_id is None:
-        announcement_id = f"announce_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    # Картинка загружается в Telegram один раз, дальше отправляется ее file_id.
+    # file_id хранится по хэшу содержимого и переживает перезапуски.
+    photo_hash = None
+    photo = {'file_id': None}
+    upload_lock = asyncio.Lock()
+    if photo_path and os.path.exists(photo_path):
+        photo_hash = await asyncio.to_thread(file_sha256, photo_path)
+        photo['file_id'] = await asyncio.to_thread(announcement_manager.get_cached_file_id, photo_hash)
     
-    logging.info(f"Начинаю рассылку объявления для {len(all_users)} пользователей")
+    async def upload_photo(user_id):
+        with open(photo_path, 'rb') as f:
+            message = await bot.send_photo(
+                chat_id=user_id,
+                photo=InputFile(f),
+                caption=message_text,
+                parse_mode='HTML'
+            )
+        photo['file_id'] = message.photo[-1].file_id
+        await asyncio.to_thread(announcement_manager.cache_file_id, photo_hash, photo['file_id'])
+        return message
     
-    for user_id in all_users:
+    async def send_photo(user_id, reupload=True):
+        if photo['file_id'] is None:
+            # Пока первый отправитель загружает файл, остальные ждут его file_id
+            async with upload_lock:
+                if photo['file_id'] is None:
+                    return await upload_photo(user_id)
+        
+        file_id = photo['file_id']
         try:
-            # Проверяем, не получал ли пользователь уже это объявление
-            if announcement_manager.is_announcement_sent(user_id, announcement_id):
-                logging.info(f"Пользователь {user_id} уже получал это объявление")
-                continue
-            
-            # Отправляем сообщение с картинкой или без
-            if photo_path and os.path.exists(photo_path):
-                with open(photo_path, 'rb') as photo:
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=InputFile(photo),
-                        caption=message_text,
-                        parse_mode='HTML'
-                    )
-            else:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message_text,
-                    parse_mode='HTML'
-                )
+            return await bot.send_photo(
+                chat_id=user_id,
+                photo=file_id,
+                caption=message_text,
+                parse_mode='HTML'
+            )
+        except BadRequest as e:
+            # Сохраненный file_id мог устареть - загружаем файл заново
+            if not reupload or 'file' not in str(e).lower():
+                raise
+            if photo['file_id'] == file_id:
+                photo['file_id'] = None
+                await asyncio.to_thread(announcement_manager.forget_file_id, photo_hash)
+            return await send_photo(user_id, reupload=False)
+    
+    async def send(user_id):
+        # Отправляем сообщение с картинкой или без
+        if photo_hash:
+            return await send_photo(user_id)
+        return await bot.send_message(
+            chat_id=user_id,
+            text=message_text,
+            parse_mode='HTML'
+        )
+    
+    delivered = []
+    unreachable = []
+    # Ошибки доставки пишутся сводкой по причинам, а не строкой на получателя
+    failures = OutcomeLog(f"Рассылка {job_id}: не доставлено")
+    
+    async def flush_delivered():
+        batch = delivered[:]
+        delivered.clear()
+        if batch:
+            try:
+                await asyncio.to_thread(announcement_manager.mark_announcements_sent, job_id, batch)
+            except Exception:
+                # Вернем отметки, чтобы записать их при следующем сбросе
+                delivered[:0] = batch
+                raise
+        batch = unreachable[:]
+        unreachable.clear()
+        if batch:
+            try:
+                await asyncio.to_thread(announcement_manager.mark_unreachable, batch)
+            except Exception:
+                unreachable[:0] = batch
+                raise
+    
+    async def on_success(user_id, message):
+        # Отмечаем объявление как отправленное (пачками)
+        delivered.append(user_id)
+        if len(delivered) >= MARK_BATCH_SIZE:
+            await flush_delivered()
+    
+    async def on_failure(user_id, error):
+        reason = classify_delivery_error(error)
+        if reason:
+            # Больше не пытаемся писать тем, кто заблокировал бота или удалил аккаунт
+            unreachable.append((reason, user_id))
+        failures.record(user_id, reason or f"{type(error).__name__}: {error}")
+    
+    # Лимиты Telegram соблюдает движок рассылки
+    engine = BroadcastEngine()
+    active[job_id] = {'engine': engine, 'sent': job['sent'], 'failed': job['failed']}
+    cursor = job['cursor']
+    finished = False
+    
+    logging.info(f"Начинаю рассылку {job_id} с пользователя {cursor}")
+    
+    try:
+        while True:
+            page = await asyncio.to_thread(
+                announcement_manager.get_pending_recipients, job_id, cursor, JOB_PAGE_SIZE,
+                job['active_since'], job['min_questions']
+            )
+            if not page:
+                finished = True
+                break
             
-            # Отмечаем объявление как отправленное
-            announcement_manager.mark_announcement_sent(user_id, announcement_id)
-            successful_sends += 1
+            await engine.run(page, send, on_success, on_failure)
+            await flush_delivered()
             
-            # Небольшая задержка чтобы не превысить лимиты Telegram
-            import asyncio
-            await asyncio.sleep(0.1)
+            cursor = page[-1]
+            await asyncio.to_thread(
+                announcement_manager.save_job_progress, job_id, cursor,
+                job['sent'] + engine.sent, job['failed'] + engine.failed
+            )
             
-        except Exception as e:
-            logging.error(f"Не удалось отправить объявление пользователю {user_id}: {e}")
-            failed_sends += 1
+            # Админ мог поставить рассылку на паузу или отменить ее
+            current = await asyncio.to_thread(announcement_manager.get_job, job_id)
+            if current['status'] != 'running':
+                break
+    finally:
+        await flush_delivered()
+        failures.summary(force=True)
+        active.pop(job_id, None)
+    
+    if finished:
+        await asyncio.to_thread(announcement_manager.set_job_status, job_id, 'done', ('running',))
     
-    logging.info(f"Рассылка завершена. Успешно: {successful_sends}, Не удалось: {failed_sends}")
+    logging.info(f"Рассылка {job_id} {'завершена' if finished else 'остановлена'}. "
+                 f"Успешно: {engine.sent}, Не удалось: {engine.failed}, "
+                 f"скорость: {engine.rate:.1f} сообщ./с")
+
+
+class BroadcastJobExists(Exception):
+    """Задание рассылки с таким ID уже создано раньше"""
+
+
+def new_job_id(prefix):
+    """Уникальный ID задания: дата, время и случайный суффикс"""
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(2)}"
+
+
+async def create_broadcast_job(context: ContextTypes.DEFAULT_TYPE, 
+                               message_text: str, 
+                               photo_path: str = None,
+                               announcement_id: str = None,
+                               created_by: int = None,
+                               active_since: str = None,
+                               min_questions: int = None):
+    """Создает сохраняемое задание рассылки и возвращает его ID
+
+    Задания хранятся бессрочно, поэтому повтор ID не пропускается молча:
+    выбрасывается BroadcastJobExists.
+    """
+    # Создаем уникальный ID объявления если не предоставлен
+    if announcement_id is None:
+        announcement_id = new_job_id("announce")
+    
+    created = await asyncio.to_thread(
+        context.bot_data['announcements'].create_job,
+        announcement_id, message_text, photo_path, created_by, active_since, min_questions
+    )
+    if not created:
+        raise BroadcastJobExists(announcement_id)
+    return announcement_id
+
+
+async def start_global_announcement(context: ContextTypes.DEFAULT_TYPE, 
+                                    message_text: str, 
+                                    photo_path: str = None,
+                                    announcement_id: str = None,
+                                    created_by: int = None,
+                                    active_since: str = None,
+                                    min_questions: int = None):
+    """Запускает рассылку в фоне и сразу возвращает ID задания
+
+    active_since (ГГГГ-ММ-ДД) и min_questions ограничивают аудиторию теми,
+    кто был активен с этой даты и ответил хотя бы на min_questions вопросов.
+    """
+    job_id = await create_broadcast_job(
+        context, message_text, photo_path, announcement_id, created_by, active_since, min_questions
+    )
+    schedule_broadcast_job(context.application, job_id)
+    return job_id
+
+
+async def send_global_announcement(context: ContextTypes.DEFAULT_TYPE, 
+                                 message_text: str, 
+                                 photo_path: str = None,
+                                 announcement_id: str = None):
+    """
+    Отправляет глобальное объявление всем пользователям бота и ждет окончания рассылки
+    
+    Args:
+        context: Контекст бота
+        message_text: Текст объявления
+        photo_path: Путь к картинке (опционально)
+        announcement_id: Уникальный ID объявления (для избежания дублирования)
+    """
+    try:
+        job_id = await create_broadcast_job(context, message_text, photo_path, announcement_id)
+    except BroadcastJobExists:
+        # Повтор того же объявления: незавершенное задание продолжится, завершенное не повторится
+        job_id = announcement_id
+    await run_broadcast(context, job_id)
 
 def create_announcement_file():
     """Создает пример файла объявления"""
@@ -0,0 +1,91 @@
+import importlib.util
+import logging
+import os
+import httpx
+from telegram.request import HTTPXRequest
+
+# Настройки по умолчанию: обработчики викторины делают короткие запросы,
+# рассылка - тысячи отправок, в том числе загрузки картинок
+INTERACTIVE_DEFAULTS = {
+    'pool_size': 64,
+    'keepalive': 32,
+    'keepalive_expiry': 30.0,
+    'connect_timeout': 5.0,
+    'read_timeout': 5.0,
+    'write_timeout': 5.0,
+    'pool_timeout': 1.0,
+    'http2': False,
+}
+BROADCAST_DEFAULTS = dict(
+    INTERACTIVE_DEFAULTS,
+    pool_size=16,
+    keepalive=16,
+    read_timeout=10.0,
+    write_timeout=20.0,
+    pool_timeout=10.0,
+)
+
+
+def request_settings(prefix, defaults=INTERACTIVE_DEFAULTS):
+    """Настройки HTTP-клиента из переменных окружения {prefix}_POOL_SIZE и т.д."""
+    settings = {}
+    for name, default in defaults.items():
+        value = os.environ.get(f'{prefix}_{name.upper()}')
+        if value is None:
+            settings[name] = default
+        elif isinstance(default, bool):
+            settings[name] = value.lower() in ('1', 'true', 'yes')
+        else:
+            settings[name] = type(default)(value)
+    return settings
+
+
+def make_request(pool_size, keepalive, keepalive_expiry, connect_timeout,
+                 read_timeout, write_timeout, pool_timeout, http2):
+    """HTTPXRequest с заданным пулом соединений, keep-alive и таймаутами
+
+    HTTP/2 включается, только если установлен пакет h2
+    (python-telegram-bot[http2]), иначе используется HTTP/1.1.
+    """
+    if http2 and importlib.util.find_spec('h2') is None:
+        logging.warning("HTTP/2 недоступен без пакета h2, используется HTTP/1.1")
+        http2 = False
+
+    return HTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        http_version='2' if http2 else '1.1',
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        },
+    )
+
+
+def api_urls():
+    """Адреса Bot API из BOT_API_URL (например, локальный сервер Bot API)
+
+    Возвращает именованные аргументы base_url и base_file_url для Bot или
+    пустой словарь, если используется api.telegram.org.
+    """
+    url = os.environ.get('BOT_API_URL')
+    if not url:
+        return {}
+    url = url.rstrip('/')
+    return {'base_url': f'{url}/bot', 'base_file_url': f'{url}/file/bot'}
+
+
+def interactive_request():
+    """Пул для обработчиков пользователей (переменные BOT_API_*)"""
+    return make_request(**request_settings('BOT_API'))
+
+
+def broadcast_request():
+    """Отдельный пул для рассылок (переменные BROADCAST_API_*)"""
+    return make_request(**request_settings('BROADCAST_API', BROADCAST_DEFAULTS))
@@ -0,0 +1,83 @@
+"""Задержка обработчиков при синхронной и асинхронной работе с базой.
+
+Имитирует N одновременных пользователей: каждый "обработчик ответа" пишет
+статистику в базу и затем ждет ответа Bot API. Сравнивает p50/p95/p99
+задержки обработчика при прямых вызовах Database (до) и через AsyncDatabase
+(после): запись уходит в буфер и сбрасывается пачками.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_async_storage --users 200 --answers 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from database import Database, AsyncDatabase
+from migrations import migrate
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def simulate_user(user_id, answers, handler, latencies, api_delay):
+    for i in range(answers):
+        started = time.perf_counter()
+        await handler(user_id, i % 2 == 0)
+        # Имитация запроса к Bot API (edit_message_text)
+        await asyncio.sleep(api_delay)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_scenario(name, handler, users, answers, api_delay):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(user_id, answers, handler, latencies, api_delay)
+        for user_id in range(1, users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:>6}: {len(latencies) / elapsed:8.0f} ответов/с | "
+          f"p50 {statistics.median(latencies) * 1000:7.2f} мс | "
+          f"p95 {percentile(latencies, 95) * 1000:7.2f} мс | "
+          f"p99 {percentile(latencies, 99) * 1000:7.2f} мс")
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        migrate(db_name)
+        db = Database(db_name)
+        for user_id in range(1, args.users + 1):
+            db.add_user(user_id, f'user{user_id}', 'Bench', None)
+
+        async def sync_handler(user_id, is_correct):
+            db.update_user_stats(user_id, is_correct)
+
+        await run_scenario('sync', sync_handler, args.users, args.answers, args.api_delay)
+
+        async_db = AsyncDatabase(db)
+        async_db.start()
+
+        async def async_handler(user_id, is_correct):
+            await async_db.update_user_stats(user_id, is_correct)
+
+        await run_scenario('async', async_handler, args.users, args.answers, args.api_delay)
+        async_db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--answers', type=int, default=20)
+    parser.add_argument('--api-delay', type=float, default=0.005,
+                        help='имитируемая задержка Bot API, секунды')
+    parser.add_argument('--db-dir', default=None,
+                        help='каталог для файла базы (по умолчанию временный каталог системы)')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""Пропускная способность обработки обновлений: последовательно и параллельно.
+
+Подает поток нажатий кнопок от N пользователей так же, как Application:
+по задаче на обновление в порядке поступления. Обработчик имитирует
+запрос к Bot API. Сравнивает последовательную обработку (как раньше),
+SimpleUpdateProcessor из PTB и PerUserUpdateProcessor и считает
+нарушения порядка: одновременную обработку или перестановку обновлений
+одного пользователя.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_concurrency --users 100 --presses 10
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from telegram import CallbackQuery, Update, User
+from telegram.ext import SimpleUpdateProcessor
+
+from update_processor import PerUserUpdateProcessor
+
+
+class Checker:
+    """Обработчик-заглушка, отслеживающий порядок обработки по пользователям"""
+
+    def __init__(self, api_delay):
+        self.api_delay = api_delay
+        self.active = set()
+        self.last_seen = {}
+        self.violations = 0
+
+    async def handle(self, update):
+        user_id = update.effective_user.id
+        press = int(update.callback_query.id)
+        if user_id in self.active or self.last_seen.get(user_id, -1) > press:
+            self.violations += 1
+        self.active.add(user_id)
+        try:
+            # Имитация edit_message_text
+            await asyncio.sleep(self.api_delay)
+        finally:
+            self.active.discard(user_id)
+        self.last_seen[user_id] = max(press, self.last_seen.get(user_id, -1))
+
+
+async def run_scenario(name, processor, updates, api_delay):
+    checker = Checker(api_delay)
+    started = time.perf_counter()
+    if processor is None:
+        for update in updates:
+            await checker.handle(update)
+    else:
+        async with processor:
+            # Application создает задачу на каждое обновление в порядке поступления
+            tasks = [
+                asyncio.create_task(processor.process_update(update, checker.handle(update)))
+                for update in updates
+            ]
+            await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>22}: {len(updates) / elapsed:8.0f} обновлений/с | "
+          f"нарушений порядка: {checker.violations}")
+
+
+async def main(args):
+    per_user = {}
+    for user_id in range(1, args.users + 1):
+        user = User(user_id, f'user{user_id}', False)
+        per_user[user_id] = [
+            Update(0, callback_query=CallbackQuery(str(press), user, 'bench', data=f'answer_{press}'))
+            for press in range(args.presses)
+        ]
+    # Перемешиваем пользователей, сохраняя порядок нажатий каждого
+    order = [user_id for user_id in per_user for _ in range(args.presses)]
+    random.shuffle(order)
+    updates = [per_user[user_id].pop(0) for user_id in order]
+
+    await run_scenario('последовательно', None, updates, args.api_delay)
+    await run_scenario('SimpleUpdateProcessor', SimpleUpdateProcessor(args.concurrency), updates, args.api_delay)
+    await run_scenario('PerUserUpdateProcessor', PerUserUpdateProcessor(args.concurrency), updates, args.api_delay)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--presses', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--api-delay', type=float, default=0.05,
+                        help='имитируемая задержка Bot API, секунды')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,120 @@
+"""Скорость генерации вопросов: прежняя поштучная функция против пула.
+
+Сравнивает вопросы/с для исходного MathBot.generate_question (random.randint
+и цикл с отбраковкой, скопирован сюда как эталон), векторной генерации
+generate_batch и выдачи из QuestionPool. Заодно проверяет, что пачки
+соблюдают прежние диапазоны чисел для каждой операции.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_questions --count 200000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from questions import OPERATIONS, QuestionPool, generate_batch, generate_operands
+
+
+def legacy_generate_question(operation_type):
+    """Исходная реализация MathBot.generate_question"""
+    if operation_type == "random":
+        operation_type = random.choice(["addition", "subtraction", "multiplication", "division"])
+
+    if operation_type == "addition":
+        a = random.randint(1, 500)
+        b = random.randint(1, 500)
+        question = f"{a} + {b}"
+        answer = a + b
+    elif operation_type == "subtraction":
+        a = random.randint(10, 250)
+        b = random.randint(1, a - 1)
+        question = f"{a} - {b}"
+        answer = a - b
+    elif operation_type == "multiplication":
+        a = random.randint(2, 15)
+        b = random.randint(2, 15)
+        question = f"{a} × {b}"
+        answer = a * b
+    elif operation_type == "division":
+        b = random.randint(2, 15)
+        a = b * random.randint(2, 15)
+        question = f"{a} ÷ {b}"
+        answer = a // b
+
+    wrong_answers = []
+    while len(wrong_answers) < 3:
+        variation = random.choice([-3, -2, -1, 1, 2, 3])
+        wrong_answer = answer + variation
+        if (wrong_answer > 0 and
+                wrong_answer != answer and
+                wrong_answer not in wrong_answers):
+            wrong_answers.append(wrong_answer)
+
+    all_answers = wrong_answers + [answer]
+    random.shuffle(all_answers)
+
+    return {
+        "question": question,
+        "correct_answer": answer,
+        "all_answers": all_answers,
+        "operation_type": operation_type
+    }
+
+
+def check_ranges(size=100000):
+    """Проверяет, что векторная генерация не вышла за прежние диапазоны"""
+    rng = np.random.default_rng()
+    limits = {
+        "addition": ((1, 500), (1, 500)),
+        "subtraction": ((10, 250), (1, 249)),
+        "multiplication": ((2, 15), (2, 15)),
+        "division": ((4, 225), (2, 15)),
+    }
+    for operation_type in OPERATIONS:
+        a, b, answer = generate_operands(operation_type, size, rng)
+        (a_min, a_max), (b_min, b_max) = limits[operation_type]
+        assert a_min <= a.min() and a.max() <= a_max, operation_type
+        assert b_min <= b.min() and b.max() <= b_max, operation_type
+        if operation_type == "subtraction":
+            assert (b < a).all()
+        if operation_type == "division":
+            assert (a % b == 0).all() and 2 <= answer.min() and answer.max() <= 15
+
+        for question in generate_batch(operation_type, 10000, rng):
+            answers = question["all_answers"]
+            correct = question["correct_answer"]
+            assert len(set(answers)) == 4 and correct in answers
+            assert all(x > 0 and abs(x - correct) <= 3 for x in answers)
+    print("Диапазоны совпадают с прежней реализацией")
+
+
+def measure(name, func, count):
+    started = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>28}: {count / elapsed:12,.0f} вопросов/с")
+
+
+def main(args):
+    check_ranges()
+    rng = np.random.default_rng()
+    pool = QuestionPool()
+    pool.warm_up()
+
+    for operation_type in OPERATIONS + ("random",):
+        print(f"\n{operation_type}")
+        measure("legacy generate_question",
+                lambda n: [legacy_generate_question(operation_type) for _ in range(n)], args.count)
+        if operation_type != "random":
+            measure("generate_batch",
+                    lambda n: generate_batch(operation_type, n, rng), args.count)
+        measure("QuestionPool.get",
+                lambda n: [pool.get(operation_type) for _ in range(n)], args.count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000)
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+"""Пропускная способность викторины при шардинге по 1, 2, 4 и 8 процессам.
+
+Запускает рабочие процессы MathBot с офлайн-транспортом Bot API и общей
+базой SQLite, раздает им через ShardRouter нажатия кнопок ответа от N
+пользователей и замеряет обновлений/с от начала раздачи до завершения
+обработки во всех процессах. Время запуска процессов не учитывается.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_sharding --users 400 --answers 25
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.offline import OfflineRequest, callback_update, message_update
+from callbacks import AnswerSigner, callback_secret
+from sharding import start_workers
+
+TOKEN = '123456:BENCH'
+
+
+def make_updates(users, answers):
+    """/start и ответы каждого пользователя, перемешанные между пользователями"""
+    signer = AnswerSigner(callback_secret(TOKEN))
+    updates = []
+    update_id = 0
+    for i in range(answers + 1):
+        for user_id in range(1, users + 1):
+            update_id += 1
+            if i == 0:
+                updates.append(message_update(update_id, user_id, '/start'))
+            else:
+                data = signer.encode(user_id, signer.new_question_id(), 'multiplication', 6, 6 if i % 2 else 7)
+                updates.append(callback_update(update_id, user_id, data))
+    return updates
+
+
+def run_scenario(workers, updates):
+    with tempfile.TemporaryDirectory() as tmp:
+        # Рабочие процессы создают базу в текущем каталоге
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            done = multiprocessing.get_context('spawn').Queue()
+            processes, router = start_workers(TOKEN, workers, OfflineRequest, done)
+            for _ in range(workers):
+                done.get()
+
+            started = time.time()
+            for update in updates:
+                router.route(update)
+            router.stop()
+            finished = max(done.get()[2] for _ in range(workers))
+            for process in processes:
+                process.join()
+        finally:
+            os.chdir(cwd)
+
+    elapsed = finished - started
+    print(f"{workers} процесс(ов): {len(updates) / elapsed:8.0f} обновлений/с ({elapsed:.2f} с)")
+
+
+def main(args):
+    updates = make_updates(args.users, args.answers)
+    print(f"{len(updates)} обновлений, ядер: {os.cpu_count()}")
+    for workers in args.workers:
+        run_scenario(workers, updates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--answers', type=int, default=25)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    main(parser.parse_args())
@@ -0,0 +1,127 @@
+"""Сквозная задержка обработки обновлений в режиме вебхука без Telegram.
+
+Поднимает MathBot с настоящими обработчиками, WebhookServer на локальном
+порту и офлайн-транспортом Bot API. Каждый из N пользователей держит
+keep-alive соединение и по очереди отправляет POST: /start, затем нажатия
+кнопок ответа с подписанными callback_data. Задержка - от отправки POST до
+вызова Bot API, которым обработчик отвечает пользователю.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_webhook --users 100 --answers 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_async_storage import percentile
+from benchmarks.offline import OfflineRequest, callback_update, message_update
+from bot import MathBot
+from webhook import WebhookServer
+
+SECRET = 'bench-secret'
+PATH = '/webhook'
+
+
+class Replies:
+    """Ожидание ответа бота в конкретный чат"""
+
+    def __init__(self):
+        self.waiting = {}
+
+    def on_call(self, method, parameters):
+        if method in ('sendMessage', 'editMessageText'):
+            future = self.waiting.pop(parameters.get('chat_id'), None)
+            if future and not future.done():
+                future.set_result(time.perf_counter())
+
+    def expect(self, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[chat_id] = future
+        return future
+
+
+async def post(reader, writer, payload, secret=SECRET):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST {PATH} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1])
+
+
+async def simulate_user(bot, port, replies, user_id, answers, latencies, update_ids):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for i in range(answers + 1):
+            if i == 0:
+                payload = message_update(next(update_ids), user_id, '/start')
+            else:
+                data = bot.answers.encode(
+                    user_id, bot.answers.new_question_id(), 'addition', 10, 10 if i % 2 else 9
+                )
+                payload = callback_update(next(update_ids), user_id, data)
+
+            reply = replies.expect(user_id)
+            started = time.perf_counter()
+            status = await post(reader, writer, payload)
+            assert status == 200, status
+            latencies.append(await asyncio.wait_for(reply, 30) - started)
+    finally:
+        writer.close()
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        # База бота создается в текущем каталоге
+        os.chdir(tmp)
+        replies = Replies()
+        request = OfflineRequest(replies.on_call)
+        bot = MathBot('123456:BENCH', request=request)
+        application = bot.application
+
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        server = WebhookServer(application, PATH, SECRET)
+        await server.start('127.0.0.1', 0)
+
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            forged = await post(reader, writer, message_update(0, 1, '/start'), secret='wrong')
+            writer.close()
+            print(f"Запрос с неверным секретом: HTTP {forged}")
+
+            latencies = []
+            update_ids = iter(range(1, 10 ** 9))
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                simulate_user(bot, server.port, replies, user_id, args.answers, latencies, update_ids)
+                for user_id in range(1, args.users + 1)
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            await server.stop()
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+        print(f"{len(latencies)} обновлений за {elapsed:.2f} с: "
+              f"{len(latencies) / elapsed:.0f} обновлений/с | "
+              f"p50 {statistics.median(latencies) * 1000:.2f} мс | "
+              f"p95 {percentile(latencies, 95) * 1000:.2f} мс | "
+              f"p99 {percentile(latencies, 99) * 1000:.2f} мс | "
+              f"вызовов Bot API: {request.calls}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--answers', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Локальная замена сервера Bot API для нагрузочных тестов.
+
+FakeBotAPI принимает настоящие HTTP-запросы PTB (POST /bot<token>/<метод>,
+form-urlencoded или multipart) по keep-alive соединениям и отвечает
+правдоподобными результатами. О каждом вызове сообщается в
+on_call(method, parameters): нагрузочный тест по ним узнает, что бот
+ответил пользователю. Бот направляется сюда переменной BOT_API_URL.
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qsl
+
+from benchmarks.offline import api_result
+
+MULTIPART_FIELD = re.compile(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n')
+
+
+def parse_parameters(content_type, body):
+    """Параметры вызова; значения-объекты (reply_markup и т.п.) разбираются из JSON"""
+    if content_type.startswith('multipart/form-data'):
+        # Файлы не нужны, достаточно простых полей
+        pairs = [(name.decode(), value.decode('utf-8', 'replace'))
+                 for name, value in MULTIPART_FIELD.findall(body)]
+    elif content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    else:
+        pairs = parse_qsl(body.decode())
+
+    parameters = {}
+    for name, value in pairs:
+        if value[:1] in ('{', '['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        parameters[name] = value
+    return parameters
+
+
+class FakeBotAPI:
+    def __init__(self, on_call=None, latency=0.0):
+        self.on_call = on_call
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}'
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                target = lines[0].split(' ')[1]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = target.rsplit('/', 1)[-1]
+                parameters = parse_parameters(headers.get('content-type', ''), body)
+                response = json.dumps(self._call(method, parameters)).encode()
+                if self.latency:
+                    # Имитация сетевой задержки до Telegram
+                    await asyncio.sleep(self.latency)
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: ' + str(len(response)).encode() + b'\r\n\r\n' + response
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _call(self, method, parameters):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        self._message_id += 1
+        if self.on_call:
+            self.on_call(method, parameters)
+        return {'ok': True, 'result': api_result(method, parameters, self._message_id)}
@@ -0,0 +1,151 @@
+"""Нагрузочный тест MathBot с синтетическими пользователями без Telegram.
+
+Поднимает FakeBotAPI на локальном порту и MathBot с настоящими
+обработчиками, пулом HTTP-соединений и базой, направленный на него через
+BOT_API_URL. Каждый синтетический пользователь отправляет /start, выбирает
+операцию кнопкой op_* из присланной ботом клавиатуры и отвечает на вопросы
+кнопками answer_*, дожидаясь ответа бота перед следующим нажатием. Затем
+всем пользователям отправляется рассылка.
+
+Выводит ответов/с, перцентили задержки обработчиков (от получения
+обновления до ответа бота), скорость записи событий в базу и скорость
+рассылки.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --users 1000 --answers 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import types
+
+from benchmarks.bench_async_storage import percentile
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.offline import callback_update, message_update
+
+TOKEN = '123456:LOAD'
+
+
+class SyntheticUsers:
+    """Ожидание ответов бота и сбор задержек по типам действий"""
+
+    def __init__(self, application):
+        self.application = application
+        self.waiting = {}
+        self.latencies = {'start': [], 'operation': [], 'answer': []}
+        self._update_id = 0
+
+    def on_call(self, method, parameters):
+        if method in ('sendMessage', 'editMessageText') and 'chat_id' in parameters:
+            future = self.waiting.pop(int(parameters['chat_id']), None)
+            if future and not future.done():
+                future.set_result((time.perf_counter(), parameters))
+
+    async def send(self, kind, user_id, make_update, payload):
+        """Передает обновление боту и ждет его ответа в чат пользователя"""
+        from telegram import Update
+
+        self._update_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[user_id] = future
+        started = time.perf_counter()
+        data = make_update(self._update_id, user_id, payload)
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        finished, reply = await asyncio.wait_for(future, 60)
+        self.latencies[kind].append(finished - started)
+        return reply
+
+    @staticmethod
+    def buttons(reply, prefix):
+        keyboard = reply.get('reply_markup', {}).get('inline_keyboard', [])
+        return [button['callback_data'] for row in keyboard for button in row
+                if button.get('callback_data', '').startswith(prefix)]
+
+    async def simulate(self, user_id, answers):
+        reply = await self.send('start', user_id, message_update, '/start')
+        operation = random.choice(self.buttons(reply, 'op_'))
+        reply = await self.send('operation', user_id, callback_update, operation)
+        for _ in range(answers):
+            answer = random.choice(self.buttons(reply, 'answer_'))
+            reply = await self.send('answer', user_id, callback_update, answer)
+
+
+def report_latency(name, values):
+    print(f"{name:>10}: p50 {statistics.median(values) * 1000:7.2f} мс | "
+          f"p95 {percentile(values, 95) * 1000:7.2f} мс | "
+          f"p99 {percentile(values, 99) * 1000:7.2f} мс")
+
+
+async def main(args):
+    # Модули бота импортируются после настройки окружения: BROADCAST_RATE
+    # читается при импорте
+    from announcement import run_broadcast
+    from bot import MathBot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # База бота создается в текущем каталоге
+        os.chdir(tmp)
+        api = FakeBotAPI(latency=args.api_latency)
+        await api.start()
+        os.environ['BOT_API_URL'] = api.url
+
+        bot = MathBot(TOKEN)
+        application = bot.application
+        users = SyntheticUsers(application)
+        api.on_call = users.on_call
+
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                users.simulate(user_id, args.answers) for user_id in range(1, args.users + 1)
+            ))
+            quiz_elapsed = time.perf_counter() - started
+            await bot.db.flush()
+
+            conn = sqlite3.connect('math_bot.db')
+            events = conn.execute('SELECT COUNT(*) FROM answer_events').fetchone()[0]
+
+            announcements = application.bot_data['announcements']
+            await asyncio.to_thread(announcements.create_job, 'load-test', 'Нагрузочный тест', None, 0, None, None)
+            context = types.SimpleNamespace(bot_data=application.bot_data, bot=application.bot)
+            started = time.perf_counter()
+            await run_broadcast(context, 'load-test')
+            broadcast_elapsed = time.perf_counter() - started
+            job = await asyncio.to_thread(announcements.get_job, 'load-test')
+            conn.close()
+        finally:
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+            await api.stop()
+
+    answers = len(users.latencies['answer'])
+    print(f"Пользователей: {args.users}, ответов: {answers} за {quiz_elapsed:.2f} с "
+          f"-> {answers / quiz_elapsed:.0f} ответов/с")
+    for kind, values in users.latencies.items():
+        report_latency(kind, values)
+    print(f"Запись в базу: {events} событий, {events / quiz_elapsed:.0f} событий/с")
+    print(f"Рассылка: отправлено {job['sent']}, ошибок {job['failed']} за {broadcast_elapsed:.2f} с "
+          f"-> {job['sent'] / broadcast_elapsed:.0f} сообщ./с (лимит {args.broadcast_rate:g}/с)")
+    print(f"Вызовы Bot API: {dict(sorted(api.calls.items()))}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--answers', type=int, default=20)
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='имитируемая задержка Bot API, секунды')
+    parser.add_argument('--broadcast-rate', type=float, default=1000,
+                        help='лимит рассылки, сообщений в секунду (в Telegram - 30)')
+    args = parser.parse_args()
+    os.environ['BROADCAST_RATE'] = str(args.broadcast_rate)
+    asyncio.run(main(args))
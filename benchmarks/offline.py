@@ -0,0 +1,96 @@
+"""Офлайн-транспорт Bot API для бенчмарков: бот работает без сети.
+
+OfflineRequest отвечает на вызовы Bot API правдоподобными заглушками и
+сообщает о каждом вызове в on_call(method, parameters), чтобы бенчмарк мог
+замерить, когда обработчик ответил пользователю.
+"""
+import json
+import time
+
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'MathBot', 'username': 'math_bench_bot'}
+
+
+def api_result(method, parameters, message_id):
+    """Правдоподобный результат вызова Bot API method"""
+    if method == 'getMe':
+        return BOT_USER
+    if method in ('sendMessage', 'sendPhoto', 'editMessageText'):
+        message = {
+            'message_id': int(parameters.get('message_id', message_id)),
+            'date': int(time.time()),
+            'chat': {'id': int(parameters.get('chat_id', 0)), 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if method == 'sendPhoto':
+            message['photo'] = [{'file_id': 'offline-photo', 'file_unique_id': 'offline-photo',
+                                 'width': 1, 'height': 1}]
+        else:
+            message['text'] = parameters.get('text', '')
+        return message
+    return True
+
+
+class OfflineRequest(BaseRequest):
+    def __init__(self, on_call=None):
+        self.on_call = on_call
+        self.calls = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls += 1
+        if self.on_call:
+            self.on_call(api_method, parameters)
+        self._message_id += 1
+        body = {'ok': True, 'result': api_result(api_method, parameters, self._message_id)}
+        return 200, json.dumps(body).encode()
+
+
+def message_update(update_id, user_id, text):
+    """Запись обновления с текстовым сообщением в личном чате"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            if text.startswith('/') else [],
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    """Запись обновления с нажатием inline-кнопки под сообщением бота"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'data': data,
+            'message': {
+                'message_id': user_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'Вопрос',
+            },
+        },
+    }
@@ -0,0 +1,256 @@
+"""Набор микробенчмарков горячих путей на синтетических базах 10k/100k/1M.
+
+Покрывает генерацию вопросов по типам операций, Database.add_user,
+update_user_stats, пачечную запись статистики, get_user_stats, запросы
+админских команд /stats, /quick_stats и /list_users и проверки доставки
+объявлений AnnouncementManager. Базы заполняются один раз и кэшируются в
+--db-dir; каждый прогон работает с копией, чтобы записи не накапливались.
+
+Результаты пишутся в JSON (--output) и сравниваются с сохраненным
+прогоном (--compare): замедление p50 больше --threshold считается
+регрессией, и код выхода становится 1.
+
+Запуск из корня репозитория:
+    python -m benchmarks.suite --scales 10000 100000 --output results.json
+    python -m benchmarks.suite --scales 10000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from announcement import AnnouncementManager
+from database import Database, answer_event, get_pool
+from migrations import migrate
+from questions import OPERATIONS, QuestionPool
+
+SEEDED_ANNOUNCEMENT = 'bench-seeded'
+
+
+def seed_database(path, users, rng):
+    """Заполняет базу users пользователями, журналом ответов и доставками"""
+    migrate(path)
+    conn = get_pool(path).connection()
+    now = time.time()
+    with conn:
+        batch = []
+        for user_id in range(1, users + 1):
+            total = rng.randint(0, 200)
+            created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.randint(0, 365 * 86400)))
+            batch.append((user_id, f'user{user_id}', f'User{user_id}', None,
+                          total, rng.randint(0, total), created_at, created_at))
+            if len(batch) == 10000:
+                conn.executemany('''
+                    INSERT INTO users (user_id, username, first_name, last_name, total_questions,
+                                       correct_answers, created_at, last_active_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+                batch = []
+        if batch:
+            conn.executemany('''
+                INSERT INTO users (user_id, username, first_name, last_name, total_questions,
+                                   correct_answers, created_at, last_active_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+
+        # Несжатый журнал ответов за последние сутки
+        conn.executemany(
+            'INSERT INTO answer_events (user_id, operation_type, is_correct, answered_at) VALUES (?, ?, ?, ?)',
+            (answer_event(rng.randint(1, users), rng.random() < 0.7, rng.choice(OPERATIONS))
+             for _ in range(min(users, 100000)))
+        )
+        # Половина пользователей уже получила объявление
+        conn.executemany(
+            'INSERT INTO announcement_deliveries (announcement_id, user_id) VALUES (?, ?)',
+            ((SEEDED_ANNOUNCEMENT, user_id) for user_id in range(1, users + 1, 2))
+        )
+    get_pool(path).close()
+
+
+def seeded_copy(db_dir, users, work_dir):
+    """Копия заполненной базы на users пользователей (заполняется один раз)"""
+    seed = os.path.join(db_dir, f'seed_{users}.db')
+    if not os.path.exists(seed):
+        print(f"Заполнение базы на {users} пользователей...", file=sys.stderr)
+        started = time.perf_counter()
+        seed_database(seed + '.tmp', users, random.Random(users))
+        os.replace(seed + '.tmp', seed)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(seed + '.tmp' + suffix):
+                os.remove(seed + '.tmp' + suffix)
+        print(f"  готово за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+    path = os.path.join(work_dir, f'run_{users}.db')
+    shutil.copy(seed, path)
+    # Схема могла обновиться после заполнения
+    migrate(path)
+    return path
+
+
+def measure(name, users, func, iterations):
+    """Вызывает func(i) iterations раз и возвращает сводку задержек"""
+    func(0)  # прогрев: кэш подготовленных выражений и страниц
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter_ns()
+        func(i)
+        timings.append(time.perf_counter_ns() - started)
+    timings.sort()
+    total = sum(timings)
+    result = {
+        'name': name,
+        'users': users,
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / (total / 1e9), 1),
+        'mean_us': round(total / iterations / 1000, 2),
+        'p50_us': round(statistics.median(timings) / 1000, 2),
+        'p95_us': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] / 1000, 2),
+    }
+    print(f"{name:>48} {users or '':>8} | {result['ops_per_sec']:>12,.0f} оп/с | "
+          f"p50 {result['p50_us']:>10.2f} мкс | p95 {result['p95_us']:>10.2f} мкс")
+    return result
+
+
+def question_benchmarks(iterations):
+    pool = QuestionPool()
+    pool.warm_up()
+    return [
+        measure(f'generate_question[{operation_type}]', 0, lambda i, op=operation_type: pool.get(op), iterations)
+        for operation_type in OPERATIONS + ('random',)
+    ]
+
+
+def storage_benchmarks(path, users, iterations, rng):
+    db = Database(path)
+    announcements = AnnouncementManager(path)
+    random_user = lambda i: rng.randint(1, users)
+    heavy = max(1, iterations // 100)
+
+    def apply_batch(i):
+        rows = {}
+        events = []
+        for _ in range(500):
+            user_id = random_user(i)
+            is_correct = rng.random() < 0.7
+            total, correct = rows.get(user_id, (0, 0))
+            rows[user_id] = (total + 1, correct + is_correct)
+            events.append(answer_event(user_id, is_correct, rng.choice(OPERATIONS)))
+        db.apply_stats_batch([(t, c, u) for u, (t, c) in rows.items()], events)
+
+    # Ключи страниц из середины базы: стоимость страницы не должна зависеть от размера
+    page_cursors = db.pool.connection().execute(
+        'SELECT created_at, user_id FROM users WHERE user_id % ? = 0', (max(1, users // 100),)
+    ).fetchall()
+
+    def admin_stats(i):
+        db.get_summary_stats()
+        db.get_top_users(5)
+        db.get_recent_registrations(7)
+        db.get_operation_stats()
+
+    results = [
+        measure('Database.add_user[new]', users,
+                lambda i: db.add_user(users + 1 + i + iterations, 'new', 'New', None), iterations),
+        measure('Database.add_user[existing]', users,
+                lambda i: db.add_user(random_user(i), 'user', 'User', None), iterations),
+        measure('Database.update_user_stats', users,
+                lambda i: db.update_user_stats(random_user(i), i % 3 != 0, OPERATIONS[i % 4]), iterations),
+        measure('Database.apply_stats_batch[500]', users, apply_batch, heavy),
+        measure('Database.get_user_stats', users, lambda i: db.get_user_stats(random_user(i)), iterations),
+        measure('admin.stats', users, admin_stats, iterations),
+        measure('admin.quick_stats', users, lambda i: db.get_summary_stats(), iterations),
+        measure('admin.list_users[page]', users,
+                lambda i: db.list_users(page_cursors[i % len(page_cursors)]), iterations),
+        measure('AnnouncementManager.is_announcement_sent', users,
+                lambda i: announcements.is_announcement_sent(random_user(i), SEEDED_ANNOUNCEMENT), iterations),
+        measure('AnnouncementManager.get_pending_recipients[200]', users,
+                lambda i: announcements.get_pending_recipients(SEEDED_ANNOUNCEMENT, random_user(i), 200), iterations),
+        measure('AnnouncementManager.count_pending_recipients', users,
+                lambda i: announcements.count_pending_recipients(SEEDED_ANNOUNCEMENT), heavy),
+    ]
+    db.pool.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Печатает изменения относительно baseline и возвращает число регрессий"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['name'], r['users']): r for r in baseline['results']}
+
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('commit')}), порог {threshold:.0%}")
+    regressions = 0
+    for result in results:
+        before = previous.get((result['name'], result['users']))
+        if before is None:
+            continue
+        change = result['p50_us'] / before['p50_us'] - 1 if before['p50_us'] else 0.0
+        mark = ''
+        if change > threshold:
+            mark = '  РЕГРЕССИЯ'
+            regressions += 1
+        print(f"{result['name']:>48} {result['users'] or '':>8} | p50 {before['p50_us']:>10.2f} -> "
+              f"{result['p50_us']:>10.2f} мкс ({change:+.1%}){mark}")
+    return regressions
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    db_dir = args.db_dir or os.path.join(tempfile.gettempdir(), 'math_bot_bench')
+    os.makedirs(db_dir, exist_ok=True)
+
+    results = question_benchmarks(args.iterations * 10)
+    with tempfile.TemporaryDirectory(dir=db_dir) as work_dir:
+        for users in args.scales:
+            path = seeded_copy(db_dir, users, work_dir)
+            results.extend(storage_benchmarks(path, users, args.iterations, rng))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nРезультаты записаны в {args.output}")
+
+    if args.compare:
+        if compare(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='число пользователей в синтетических базах')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db-dir', default=None,
+                        help='каталог для кэша заполненных баз')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='допустимое замедление p50, доля')
+    main(parser.parse_args())
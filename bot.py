@@ -1,29 +1,78 @@
+import asyncio
 import logging
-import random
 import json
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from database import Database
-from admin_commands import setup_admin_handlers
+from database import Database, AsyncDatabase
+from questions import QuestionPool
+from callbacks import AnswerSigner, InvalidCallback, callback_secret
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from api_request import api_urls, broadcast_request, interactive_request
+from metrics import METRICS_PORT, REGISTRY, MetricsServer, instrument_handlers
+from webhook import run_webhook, webhook_config_from_env
+from sharding import WORKERS, run_sharded
+from migrations import migrate
+from announcement import AnnouncementManager, cancel_broadcast_jobs, resume_broadcast_jobs
+from admin_commands import is_admin, setup_admin_handlers, stats as admin_stats
+from logging_config import setup_logging
 
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования: запись в поток вывода идет вне цикла событий
+setup_logging()
 
 
 class MathBot:
-    def __init__(self, token):
-        self.application = Application.builder().token(token).build()
-        self.db = Database()
+    def __init__(self, token, request=None, use_updater=True, resume_broadcasts=True,
+                 metrics_port=METRICS_PORT):
+        builder = Application.builder()
+        if request is not None:
+            # Свой транспорт Bot API (например, офлайн-заглушка в бенчмарках)
+            builder = builder.request(request)
+        else:
+            builder = builder.request(interactive_request())
+        urls = api_urls()
+        if urls:
+            builder = builder.base_url(urls['base_url']).base_file_url(urls['base_file_url'])
+        if not use_updater:
+            # Рабочий процесс шардинга: обновления приходят от входного процесса
+            builder = builder.updater(None)
+        # Незавершенные рассылки продолжает только один процесс
+        self.resume_broadcasts = resume_broadcasts
+        self.application = (
+            builder
+            .token(token)
+            # Разные пользователи обрабатываются параллельно, один пользователь - по порядку
+            .concurrent_updates(PerUserUpdateProcessor())
+            # user_data хранится в math_bot.db и подгружается по мере обращения
+            .persistence(SQLitePersistence())
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        # Схема обновляется один раз при запуске, дальше хранилища только используются
+        migrate()
+        self.db = AsyncDatabase(Database())
+        self.application.bot_data['db'] = self.db
+        self.application.bot_data['announcements'] = AnnouncementManager()
+        # Рассылки ходят в Bot API через свой пул соединений и не занимают
+        # соединения обработчиков викторины
+        self.broadcast_bot = Bot(token, request=request or broadcast_request(), **urls)
+        self.application.bot_data['broadcast_bot'] = self.broadcast_bot
+        self.questions = QuestionPool()
+        self.questions.warm_up()
+        # Правильный ответ подписывается в кнопках, а не хранится в user_data
+        self.answers = AnswerSigner(callback_secret(token))
         self.setup_handlers()
+        # Время и ошибки всех обработчиков, включая админские
+        instrument_handlers(self.application)
+        self.metrics_port = metrics_port
+        self.metrics_server = MetricsServer()
             
     def setup_handlers(self):
         """Настройка обработчиков команд"""
         self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("stats", self.show_stats_callback))
+        self.application.add_handler(CommandHandler("stats", self.stats_command))
         self.application.add_handler(CommandHandler("quiz", self.start_quiz))
         self.application.add_handler(CallbackQueryHandler(self.handle_answer, pattern="^answer_"))
         self.application.add_handler(CallbackQueryHandler(self.handle_operation, pattern="^op_"))
@@ -64,7 +113,7 @@ class MathBot:
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
-        self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        await self.db.add_user(user.id, user.username, user.first_name, user.last_name)
         
         welcome_text = f"""
 Привет, {user.first_name}! 👋
@@ -115,11 +164,18 @@ class MathBot:
         else:
             await update.message.reply_text(text, reply_markup=self.get_main_menu_keyboard())
     
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/stats: полный отчет для администраторов, личная статистика для остальных"""
+        if is_admin(update.effective_user.id):
+            await admin_stats(update, context)
+        else:
+            await self.show_stats_callback(update, context)
+    
     async def show_stats_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать статистику через callback"""
+        """Показать статистику: кнопкой (редактируя сообщение) или командой /stats"""
         query = update.callback_query
         user = update.effective_user
-        stats = self.db.get_user_stats(user.id)
+        stats = await self.db.get_user_stats(user.id)
         
         if stats:
             text = f"""
@@ -132,82 +188,35 @@ class MathBot:
         else:
             text = "Статистика не найдена. Начни викторину!"
         
-        await query.edit_message_text(text, reply_markup=self.get_stats_keyboard())
+        if query:
+            await query.edit_message_text(text, reply_markup=self.get_stats_keyboard())
+        else:
+            await update.message.reply_text(text, reply_markup=self.get_stats_keyboard())
     
     def generate_question(self, operation_type, context=None):
-        if operation_type == "random":
-            operation_type = random.choice(["addition", "subtraction", "multiplication", "division"])
-        
-        if operation_type == "addition":
-            # Сложение: числа от 1 до 100
-            a = random.randint(1, 500)
-            b = random.randint(1, 500)
-            question = f"{a} + {b}"
-            answer = a + b
-            
-        elif operation_type == "subtraction":
-            # Вычитание: гарантируем положительный результат
-            a = random.randint(10, 250)
-            b = random.randint(1, a - 1)
-            question = f"{a} - {b}"
-            answer = a - b
-            
-        elif operation_type == "multiplication":
-            # Умножение: числа от 2 до 12 (таблица умножения)
-            a = random.randint(2, 15)
-            b = random.randint(2, 15)
-            question = f"{a} × {b}"
-            answer = a * b
-            
-        elif operation_type == "division":
-            # Деление: гарантируем целый результат
-            b = random.randint(2, 15)
-            a = b * random.randint(2, 15)  # a кратно b
-            question = f"{a} ÷ {b}"
-            answer = a // b
-        
-        # Генерация неправильных ответов
-        wrong_answers = []
-        while len(wrong_answers) < 3:
-            # Создаем варианты, близкие к правильному ответу
-            variation = random.choice([-3, -2, -1, 1, 2, 3])
-            wrong_answer = answer + variation
-            
-            # Проверяем, чтобы неправильный ответ был положительным и уникальным
-            if (wrong_answer > 0 and 
-                wrong_answer != answer and 
-                wrong_answer not in wrong_answers):
-                wrong_answers.append(wrong_answer)
-        
-        # Создание списка всех ответов и их перемешивание
-        all_answers = wrong_answers + [answer]
-        random.shuffle(all_answers)
-        
-        return {
-            "question": question,
-            "correct_answer": answer,
-            "all_answers": all_answers,
-            "operation_type": operation_type
-        }
+        """Следующий вопрос из заранее сгенерированного пула"""
+        return self.questions.get(operation_type)
 
 
 
 
     
-    async def send_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE, operation_type):
-        """Отправка вопроса пользователю"""
+    async def send_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE, operation_type, feedback=None):
+        """Отправка вопроса пользователю (feedback - результат предыдущего ответа над вопросом)"""
         question_data = self.generate_question(operation_type, context)  # ← передаем context
         
-        # Сохраняем правильный ответ в контексте
-        context.user_data['current_question'] = {
-            'correct_answer': question_data["correct_answer"],
-            'operation_type': question_data["operation_type"]
-        }
+        # Правильный ответ передается в подписанных данных кнопок
+        user_id = update.effective_user.id
+        question_id = self.answers.new_question_id()
         
         # Создаем клавиатуру с вариантами ответов
         keyboard = []
         for i, answer in enumerate(question_data["all_answers"]):
-            keyboard.append([InlineKeyboardButton(str(answer), callback_data=f"answer_{answer}")])
+            callback_data = self.answers.encode(
+                user_id, question_id, question_data["operation_type"],
+                question_data["correct_answer"], answer
+            )
+            keyboard.append([InlineKeyboardButton(str(answer), callback_data=callback_data)])
         
         # Добавляем навигационные кнопки
         keyboard.extend(self.get_quiz_keyboard().inline_keyboard)
@@ -215,6 +224,8 @@ class MathBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         text = f"Вопрос: {question_data['question']} = ?"
+        if feedback:
+            text = f"{feedback}\n\n{text}"
         if hasattr(update, 'callback_query'):
             await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
         else:
@@ -224,18 +235,28 @@ class MathBot:
 
     
     async def handle_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик ответа пользователя с автоматическим переходом к следующему вопросу"""
+        """Обработчик ответа пользователя с мгновенным переходом к следующему вопросу"""
         query = update.callback_query
-        user_answer = float(query.data.replace("answer_", ""))
+        user = update.effective_user
         
-        correct_answer = context.user_data['current_question']['correct_answer']
-        operation_type = context.user_data['current_question']['operation_type']
+        # Вопрос целиком восстанавливается из подписанных данных кнопки
+        try:
+            answer_data = self.answers.decode(user.id, query.data)
+        except InvalidCallback as e:
+            logging.warning(f"Отклонен ответ пользователя {user.id}: {e}")
+            await query.answer("Этот вопрос устарел, выбери операцию заново")
+            return
         
-        user = update.effective_user
-        is_correct = user_answer == correct_answer
+        if not self.answers.claim(user.id, answer_data["question_id"], answer_data["issued_at"]):
+            await query.answer("Ответ на этот вопрос уже принят")
+            return
+        
+        correct_answer = answer_data["correct_answer"]
+        operation_type = answer_data["operation_type"]
+        is_correct = answer_data["answer"] == correct_answer
         
         # Обновляем статистику
-        self.db.update_user_stats(user.id, is_correct)
+        await self.db.update_user_stats(user.id, is_correct, operation_type)
         
         # Отправляем результат
         if is_correct:
@@ -245,22 +266,55 @@ class MathBot:
         
         await query.answer()
         
-        # Показываем результат на 2 секунды
-        await query.edit_message_text(message)
-        
-        # Ждем 2 секунды и автоматически показываем следующий вопрос
-        import asyncio
-        await asyncio.sleep(1.15)
-        
-        # Автоматически переходим к следующему вопросу
-        await self.send_question(update, context, operation_type)
+        # Результат и следующий вопрос показываются одним редактированием
+        # сообщения, без паузы внутри обработчика
+        await self.send_question(update, context, operation_type, feedback=message)
 
     
 
     
+    async def post_init(self, application: Application):
+        """Запуск фоновых задач после инициализации приложения"""
+        self.db.start()
+        await self.broadcast_bot.initialize()
+        if self.resume_broadcasts:
+            resume_broadcast_jobs(application)
+        if self.metrics_port:
+            REGISTRY.gauge('mathbot_broadcast_active', 'Выполняющиеся рассылки',
+                           lambda: [({}, len(application.bot_data.get('active_broadcasts', {})))])
+            REGISTRY.gauge('mathbot_broadcast_sent', 'Отправлено в текущих рассылках',
+                           lambda: self.broadcast_progress(application, 'sent'))
+            REGISTRY.gauge('mathbot_broadcast_rate', 'Скорость текущих рассылок, сообщений в секунду',
+                           lambda: self.broadcast_progress(application, 'rate'))
+            REGISTRY.gauge('mathbot_stats_buffer_events', 'Ответы, еще не записанные в базу',
+                           lambda: [({}, len(self.db.buffer))])
+            await self.metrics_server.start(port=self.metrics_port)
+
+    @staticmethod
+    def broadcast_progress(application, field):
+        """Значения метрики по выполняющимся рассылкам: [({'job': id}, значение)]"""
+        progress = []
+        for job_id, live in list(application.bot_data.get('active_broadcasts', {}).items()):
+            engine = live['engine']
+            value = live['sent'] + engine.sent if field == 'sent' else round(engine.rate, 2)
+            progress.append(({'job': job_id}, value))
+        return progress
+
+    async def post_shutdown(self, application: Application):
+        """Завершение работы: записываем накопленную статистику и закрываем соединения"""
+        # Рассылки прерываются здесь, а не ждутся в Application.stop()
+        await cancel_broadcast_jobs(application)
+        await self.metrics_server.stop()
+        await self.broadcast_bot.shutdown()
+        self.db.close()
+
     def run(self):
-            """Запуск бота"""
-            self.application.run_polling()
+            """Запуск бота: вебхук, если задан WEBHOOK_URL, иначе polling"""
+            webhook_config = webhook_config_from_env()
+            if webhook_config:
+                asyncio.run(run_webhook(self.application, webhook_config))
+            else:
+                self.application.run_polling()
 
 # Запуск бота
 if __name__ == "__main__":
@@ -268,5 +322,9 @@ if __name__ == "__main__":
     # Получите токен у @BotFather в Telegram
     BOT_TOKEN = os.environ.get('BOT_TOKEN','8528078230:AAFf1YQJ7fRbzlO_VYR_TKpUTKk7V37b7Rk')
     
-    bot = MathBot(BOT_TOKEN)
-    bot.run()
+    if WORKERS > 1:
+        # Входной процесс раздает обновления рабочим процессам по user_id
+        run_sharded(BOT_TOKEN, WORKERS, webhook_config_from_env())
+    else:
+        bot = MathBot(BOT_TOKEN)
+        bot.run()
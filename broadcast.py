@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from telegram.error import RetryAfter
+from metrics import BROADCAST_MESSAGES
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота и 1 в секунду на чат.
+# BROADCAST_RATE можно поднять для локального Bot API сервера и нагрузочных тестов.
+GLOBAL_RATE = float(os.environ.get('BROADCAST_RATE', 30))
+PER_CHAT_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate отправок в секунду на всех отправителей"""
+
+    def __init__(self, rate=GLOBAL_RATE, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ждет свободный токен; ожидающие обслуживаются по очереди"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Останавливает все отправки на seconds секунд (ответ RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Токены начинают копиться только после паузы, иначе после нее был бы залп
+        self._updated = self._paused_until
+
+
+class BroadcastEngine:
+    """Рассылка с ограниченным пулом одновременных отправителей.
+
+    Все отправители берут токены из общего TokenBucket, отправки в один чат
+    разнесены не меньше чем на per_chat_interval секунд. RetryAfter от
+    Telegram приостанавливает весь bucket, после паузы сообщение
+    отправляется повторно.
+    """
+
+    def __init__(self, concurrency=10, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 max_retries=3, report_interval=10):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self._chat_sent_at = {}
+        self.sent = 0
+        self.failed = 0
+        self._started = None
+        self._reported_at = None
+
+    @property
+    def rate(self):
+        """Фактическая скорость рассылки, сообщений в секунду"""
+        if self._started is None:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    async def _wait_for_chat(self, chat_id):
+        sent_at = self._chat_sent_at.get(chat_id)
+        if sent_at is not None:
+            delay = sent_at + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _deliver(self, chat_id, send):
+        """Отправляет одно сообщение с учетом лимитов и повторов после RetryAfter"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            self._chat_sent_at[chat_id] = time.monotonic()
+            try:
+                return await send(chat_id)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logging.warning(f"Лимит Telegram, пауза рассылки на {retry_after} с")
+                self.bucket.pause(retry_after)
+                if attempt == self.max_retries:
+                    raise
+
+    async def _worker(self, queue, send, on_success, on_failure):
+        while True:
+            chat_id = await queue.get()
+            try:
+                try:
+                    result = await self._deliver(chat_id, send)
+                except Exception as e:
+                    self.failed += 1
+                    BROADCAST_MESSAGES.inc('failed')
+                    callback, args = on_failure, (chat_id, e)
+                else:
+                    self.sent += 1
+                    BROADCAST_MESSAGES.inc('sent')
+                    callback, args = on_success, (chat_id, result)
+                # Ошибка обработчика не меняет исход доставки и не останавливает отправителя
+                if callback:
+                    try:
+                        await callback(*args)
+                    except Exception as e:
+                        logging.error(f"Ошибка обработчика рассылки для {chat_id}: {e!r}")
+            finally:
+                queue.task_done()
+                self._report()
+
+    def _report(self):
+        """Пишет прогресс в лог не чаще раза в report_interval секунд"""
+        now = time.monotonic()
+        if now - self._reported_at >= self.report_interval:
+            self._reported_at = now
+            logging.info(f"Рассылка: отправлено {self.sent}, ошибок {self.failed}, "
+                         f"{self.rate:.1f} сообщ./с")
+
+    async def run(self, recipients, send, on_success=None, on_failure=None):
+        """Рассылает сообщения всем recipients
+
+        send(chat_id) - корутина отправки одного сообщения,
+        on_success(chat_id, result) и on_failure(chat_id, error) - необязательные
+        корутины, вызываемые после каждой доставки или ошибки. Можно вызывать
+        несколько раз подряд (например, по страницам получателей): счетчики
+        и скорость считаются по всем вызовам.
+        """
+        if self._started is None:
+            self._started = self._reported_at = time.monotonic()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [
+            asyncio.create_task(self._worker(queue, send, on_success, on_failure))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            for chat_id in recipients:
+                await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return self.sent, self.failed
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# Лимит Telegram на callback_data
+MAX_CALLBACK_DATA = 64
+
+ANSWER_PREFIX = "answer_"
+
+# Однобуквенные коды операций, чтобы уложиться в 64 байта
+OPERATION_CODES = {
+    "addition": "a",
+    "subtraction": "s",
+    "multiplication": "m",
+    "division": "d",
+}
+CODE_OPERATIONS = {code: operation for operation, code in OPERATION_CODES.items()}
+
+# Подпись - первые 12 байт HMAC-SHA256 (16 символов base64url)
+SIGNATURE_BYTES = 12
+
+# Сколько секунд ответ на вопрос принимается после его отправки
+ANSWER_TTL = 24 * 60 * 60
+
+
+class InvalidCallback(Exception):
+    """Поддельные, устаревшие или уже использованные данные кнопки"""
+
+
+def _base36(value):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    if value < 0:
+        raise ValueError("Отрицательные числа не кодируются")
+    encoded = ""
+    while True:
+        value, rem = divmod(value, 36)
+        encoded = digits[rem] + encoded
+        if not value:
+            return encoded
+
+
+def callback_secret(token):
+    """Ключ подписи: CALLBACK_SECRET из окружения или ключ, выведенный из токена бота
+
+    Ключ из токена одинаков у всех процессов бота и не меняется при
+    перезапуске, поэтому кнопки старых сообщений продолжают работать.
+    """
+    secret = os.environ.get('CALLBACK_SECRET')
+    if secret:
+        return secret.encode()
+    return hmac.new(token.encode(), b"math-bot callback_data", hashlib.sha256).digest()
+
+
+class AnswerSigner:
+    """Подписанные callback_data кнопок ответа.
+
+    В кнопку кодируются идентификатор вопроса, операция, правильный ответ,
+    выбранный вариант и время отправки, все это подписано HMAC вместе с
+    user_id. Обработчику ответа не нужно хранить вопрос на сервере: данные
+    проверяются по подписи. Чужие и поддельные кнопки отклоняются подписью,
+    повторные нажатия - по идентификатору вопроса: недавно принятые
+    идентификаторы помнятся до истечения ttl (не больше max_seen штук).
+    """
+
+    def __init__(self, secret, ttl=ANSWER_TTL, max_seen=100000):
+        self._secret = secret
+        self.ttl = ttl
+        self.max_seen = max_seen
+        self._seen = OrderedDict()
+
+    def _sign(self, user_id, payload):
+        mac = hmac.new(self._secret, f"{user_id}:{payload}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac[:SIGNATURE_BYTES]).decode().rstrip("=")
+
+    def new_question_id(self):
+        """Случайный идентификатор вопроса, общий для всех его кнопок"""
+        return _base36(secrets.randbits(40))
+
+    def encode(self, user_id, question_id, operation_type, correct_answer, answer, issued_at=None):
+        """callback_data для одного варианта ответа"""
+        if issued_at is None:
+            issued_at = int(time.time())
+        payload = ".".join([
+            OPERATION_CODES[operation_type],
+            question_id,
+            _base36(issued_at),
+            _base36(correct_answer),
+            _base36(answer),
+        ])
+        data = f"{ANSWER_PREFIX}{payload}.{self._sign(user_id, payload)}"
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+        return data
+
+    def decode(self, user_id, data):
+        """Проверяет подпись и срок и возвращает данные ответа
+
+        Выбрасывает InvalidCallback, если кнопка подделана, принадлежит
+        другому пользователю или устарела. Повторное использование здесь не
+        проверяется - см. claim().
+        """
+        if not data.startswith(ANSWER_PREFIX):
+            raise InvalidCallback("Неизвестный формат кнопки")
+        payload, _, signature = data[len(ANSWER_PREFIX):].rpartition(".")
+        # compare_digest не принимает строки с не-ASCII символами - сравниваем байты
+        if not hmac.compare_digest(signature.encode(), self._sign(user_id, payload).encode()):
+            raise InvalidCallback("Неверная подпись")
+
+        try:
+            code, question_id, issued_at, correct_answer, answer = payload.split(".")
+            operation_type = CODE_OPERATIONS[code]
+            issued_at = int(issued_at, 36)
+            correct_answer = int(correct_answer, 36)
+            answer = int(answer, 36)
+        except (KeyError, ValueError):
+            raise InvalidCallback("Поврежденные данные кнопки")
+
+        if time.time() - issued_at > self.ttl:
+            raise InvalidCallback("Вопрос устарел")
+
+        return {
+            "question_id": question_id,
+            "operation_type": operation_type,
+            "correct_answer": correct_answer,
+            "answer": answer,
+            "issued_at": issued_at,
+        }
+
+    def claim(self, user_id, question_id, issued_at):
+        """Отмечает вопрос отвеченным; False, если ответ на него уже принят"""
+        now = time.time()
+        # Забываем вопросы, срок которых истек: их отсечет проверка ttl
+        while self._seen and next(iter(self._seen.values())) < now:
+            self._seen.popitem(last=False)
+
+        key = (user_id, question_id)
+        if key in self._seen:
+            return False
+        self._seen[key] = issued_at + self.ttl
+        if len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        return True
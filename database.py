@@ -1,99 +1,510 @@
+import asyncio
+import logging
 import sqlite3
 import json
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from metrics import timed_query
+
+DB_NAME = 'math_bot.db'
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с SQLite: по одному на поток, настроенные один раз"""
+
+    def __init__(self, db_name=DB_NAME, busy_timeout=5000, cached_statements=256):
+        self.db_name = db_name
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Открывает и настраивает новое соединение"""
+        # cached_statements - размер кэша подготовленных выражений sqlite3
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute('PRAGMA foreign_keys=ON')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        """Возвращает соединение текущего потока (создает при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Выполняет блок в транзакции: commit при успехе, rollback при ошибке"""
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def close(self):
+        """Закрывает все открытые соединения пула"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name=DB_NAME):
+    """Общий пул соединений для файла базы данных"""
+    with _pools_lock:
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = ConnectionPool(db_name)
+            _pools[db_name] = pool
+        return pool
+
+
+def recompute_counters(conn):
+    """Пересчитывает bot_counters и daily_registrations по таблице users"""
+    conn.execute('''
+        UPDATE bot_counters
+        SET (total_users, active_users, total_questions, correct_answers) = (
+            SELECT COUNT(*),
+                   COUNT(CASE WHEN total_questions > 0 THEN 1 END),
+                   COALESCE(SUM(total_questions), 0),
+                   COALESCE(SUM(correct_answers), 0)
+            FROM users
+        )
+        WHERE id = 1
+    ''')
+    conn.execute('DELETE FROM daily_registrations')
+    conn.execute('''
+        INSERT INTO daily_registrations (date, new_users)
+        SELECT DATE(created_at), COUNT(*)
+        FROM users
+        GROUP BY DATE(created_at)
+    ''')
+
 
 class Database:
-    def __init__(self, db_name='math_bot.db'):
+    def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
-        self.init_db()
-    
-    def init_db(self):
-        """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                total_questions INTEGER DEFAULT 0,
-                correct_answers INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица статистики по сессиям
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                operation_type TEXT,
-                correct_answers INTEGER DEFAULT 0,
-                total_questions INTEGER DEFAULT 0,
-                session_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
+        self.pool = get_pool(db_name)
+
+    @timed_query
+    def rebuild_counters(self):
+        """Пересчитывает агрегаты с нуля по таблице users
+
+        Возвращает показатели до и после пересчета - если они различаются,
+        инкрементальные счетчики разошлись с данными.
+        """
+        with self.pool.transaction() as conn:
+            before = self._read_counters(conn)
+            recompute_counters(conn)
+            after = self._read_counters(conn)
+        return before, after
+
+    def _read_counters(self, conn):
+        total_users, active_users, total_questions, total_correct = conn.execute('''
+            SELECT total_users, active_users, total_questions, correct_answers
+            FROM bot_counters
+            WHERE id = 1
+        ''').fetchone()
+
+        return {
+            'total_users': total_users,
+            'active_users': active_users,
+            'new_users': total_users - active_users,
+            'total_questions': total_questions,
+            'total_correct': total_correct,
+            'accuracy': round((total_correct / total_questions) * 100, 2) if total_questions > 0 else 0
+        }
+
+    @timed_query
     def add_user(self, user_id, username, first_name, last_name):
         """Добавление нового пользователя"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name))
-        
-        conn.commit()
-        conn.close()
-    
-    def update_user_stats(self, user_id, is_correct):
-        """Обновление статистики пользователя"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        if is_correct:
-            cursor.execute('''
-                UPDATE users 
-                SET total_questions = total_questions + 1,
-                    correct_answers = correct_answers + 1
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name))
+            # Пользователь снова написал боту - значит, он снова доступен для рассылок
+            conn.execute('''
+                UPDATE users
+                SET last_active_at = CURRENT_TIMESTAMP,
+                    unreachable_at = NULL,
+                    unreachable_reason = NULL
                 WHERE user_id = ?
             ''', (user_id,))
-        else:
-            cursor.execute('''
-                UPDATE users 
-                SET total_questions = total_questions + 1
+
+    def update_user_stats(self, user_id, is_correct, operation_type=None):
+        """Обновление статистики пользователя"""
+        events = [answer_event(user_id, is_correct, operation_type)] if operation_type else []
+        self.apply_stats_batch([(1, 1 if is_correct else 0, user_id)], events)
+
+    @timed_query
+    def apply_stats_batch(self, rows, events=()):
+        """Применяет накопленные приращения одной транзакцией
+
+        rows - строки (total, correct, user_id) для счетчиков в users,
+        events - строки журнала ответов (user_id, operation_type, is_correct, answered_at)
+        """
+        with self.pool.transaction() as conn:
+            conn.executemany('''
+                UPDATE users
+                SET total_questions = total_questions + ?,
+                    correct_answers = correct_answers + ?,
+                    last_active_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_user_stats(self, user_id):
-        """Получение статистики пользователя"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT total_questions, correct_answers 
-            FROM users 
+            ''', rows)
+            conn.executemany('''
+                INSERT INTO answer_events (user_id, operation_type, is_correct, answered_at)
+                VALUES (?, ?, ?, ?)
+            ''', events)
+
+    @timed_query
+    def compact_answer_events(self, keep_days=1):
+        """Сворачивает старые события ответов в user_stats и удаляет их
+
+        События старше keep_days суток суммируются в строки user_stats по
+        пользователю, операции и дню, поэтому журнал не растет бесконечно.
+        Возвращает число удаленных событий.
+        """
+        cutoff = f'-{int(keep_days)} days'
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT INTO user_stats (user_id, operation_type, correct_answers, total_questions, session_date)
+                SELECT user_id, operation_type, SUM(is_correct), COUNT(*), DATE(answered_at)
+                FROM answer_events
+                WHERE answered_at < date('now', ?)
+                GROUP BY user_id, operation_type, DATE(answered_at)
+                ON CONFLICT (user_id, operation_type, session_date) DO UPDATE
+                SET correct_answers = correct_answers + excluded.correct_answers,
+                    total_questions = total_questions + excluded.total_questions
+            ''', (cutoff,))
+            return conn.execute(
+                "DELETE FROM answer_events WHERE answered_at < date('now', ?)", (cutoff,)
+            ).rowcount
+
+    @timed_query
+    def get_operation_stats(self):
+        """Точность по типам операций: (операция, вопросов, правильных)"""
+        return self.pool.connection().execute('''
+            SELECT operation_type, total_questions, correct_answers
+            FROM operation_counters
+            ORDER BY total_questions DESC
+        ''').fetchall()
+
+    @timed_query
+    def get_user_operation_stats(self, user_id):
+        """Точность пользователя по типам операций: (операция, вопросов, правильных)"""
+        return self.pool.connection().execute('''
+            SELECT operation_type, SUM(total_questions), SUM(correct_answers)
+            FROM (
+                SELECT operation_type, total_questions, correct_answers
+                FROM user_stats
+                WHERE user_id = ?
+                UNION ALL
+                SELECT operation_type, 1, is_correct
+                FROM answer_events
+                WHERE user_id = ?
+            )
+            GROUP BY operation_type
+            ORDER BY 2 DESC
+        ''', (user_id, user_id)).fetchall()
+
+    @timed_query
+    def get_user_stats(self, user_id, pending=(0, 0)):
+        """Получение статистики пользователя
+
+        pending - еще не записанные в базу приращения (вопросов, правильных)
+        """
+        result = self.pool.connection().execute('''
+            SELECT total_questions, correct_answers
+            FROM users
             WHERE user_id = ?
-        ''', (user_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
+        ''', (user_id,)).fetchone()
+
         if result:
+            total = result[0] + pending[0]
+            correct = result[1] + pending[1]
             return {
-                'total_questions': result[0],
-                'correct_answers': result[1],
-                'accuracy': round((result[1] / result[0]) * 100, 2) if result[0] > 0 else 0
+                'total_questions': total,
+                'correct_answers': correct,
+                'accuracy': round((correct / total) * 100, 2) if total > 0 else 0
             }
         return None
+
+    @timed_query
+    def get_summary_stats(self):
+        """Общие показатели бота для админских отчетов"""
+        return self._read_counters(self.pool.connection())
+
+    @timed_query
+    def get_top_users(self, limit=5):
+        """Самые активные пользователи: (имя, вопросов, правильных)"""
+        return self.pool.connection().execute('''
+            SELECT first_name, total_questions, correct_answers
+            FROM users
+            WHERE total_questions > 0
+            ORDER BY total_questions DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+
+    @timed_query
+    def get_recent_registrations(self, days=7):
+        """Количество новых пользователей по дням: (дата, количество)"""
+        return self.pool.connection().execute('''
+            SELECT date, new_users
+            FROM daily_registrations
+            WHERE date >= date('now', ?) AND new_users > 0
+            ORDER BY date DESC
+        ''', (f'-{int(days)} days',)).fetchall()
+
+    @timed_query
+    def find_user(self, target):
+        """Поиск пользователя по ID или username"""
+        return self.pool.connection().execute('''
+            SELECT user_id, username, first_name, last_name, total_questions, correct_answers, created_at
+            FROM users
+            WHERE user_id = ? OR username = ?
+        ''', (target, target.replace('@', ''))).fetchone()
+
+    @timed_query
+    def list_users(self, cursor=None, newer=False, limit=10):
+        """Страница пользователей, начиная с последних зарегистрированных
+
+        Постраничный вывод по ключу: cursor - (created_at, user_id) крайнего
+        пользователя соседней страницы. По умолчанию возвращаются более
+        старые пользователи, при newer=True - более новые. Возвращается до
+        limit + 1 строк (лишняя означает, что дальше есть еще страница), всегда
+        от новых к старым.
+        """
+        columns = 'user_id, username, first_name, last_name, total_questions, correct_answers, created_at'
+        conn = self.pool.connection()
+        if cursor is None:
+            return conn.execute(f'''
+                SELECT {columns}
+                FROM users
+                ORDER BY created_at DESC, user_id DESC
+                LIMIT ?
+            ''', (limit + 1,)).fetchall()
+        if newer:
+            rows = conn.execute(f'''
+                SELECT {columns}
+                FROM users
+                WHERE (created_at, user_id) > (?, ?)
+                ORDER BY created_at, user_id
+                LIMIT ?
+            ''', (*cursor, limit + 1)).fetchall()
+            rows.reverse()
+            return rows
+        return conn.execute(f'''
+            SELECT {columns}
+            FROM users
+            WHERE (created_at, user_id) < (?, ?)
+            ORDER BY created_at DESC, user_id DESC
+            LIMIT ?
+        ''', (*cursor, limit + 1)).fetchall()
+
+
+def answer_event(user_id, is_correct, operation_type):
+    """Строка журнала ответов с текущим временем (UTC, как CURRENT_TIMESTAMP)"""
+    answered_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return (user_id, operation_type, 1 if is_correct else 0, answered_at)
+
+
+class StatsBuffer:
+    """Приращения статистики ответов, еще не записанные в базу"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._log = []
+        self._events = 0
+
+    def add(self, user_id, is_correct, operation_type=None):
+        """Учитывает ответ и возвращает число накопленных событий"""
+        event = answer_event(user_id, is_correct, operation_type) if operation_type else None
+        with self._lock:
+            counters = self._pending.setdefault(user_id, [0, 0])
+            counters[0] += 1
+            counters[1] += 1 if is_correct else 0
+            if event:
+                self._log.append(event)
+            self._events += 1
+            return self._events
+
+    def __len__(self):
+        """Число накопленных событий"""
+        return self._events
+
+    def get(self, user_id):
+        """Незаписанные приращения пользователя: (вопросов, правильных)"""
+        with self._lock:
+            counters = self._pending.get(user_id)
+            return tuple(counters) if counters else (0, 0)
+
+    def drain(self):
+        """Забирает все накопленное: строки (total, correct, user_id) и журнал ответов"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            log, self._log = self._log, []
+            self._events = 0
+        return [(total, correct, user_id) for user_id, (total, correct) in pending.items()], log
+
+    def restore(self, rows, log):
+        """Возвращает в буфер строки, которые не удалось записать"""
+        with self._lock:
+            for total, correct, user_id in rows:
+                counters = self._pending.setdefault(user_id, [0, 0])
+                counters[0] += total
+                counters[1] += correct
+                self._events += total
+            self._log[:0] = log
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database без блокировки цикла событий.
+
+    Все записи выполняются по очереди в одном выделенном потоке, чтения - в
+    небольшом пуле потоков (WAL позволяет читать параллельно с записью).
+    Очередь записей ограничена: при переполнении обработчики ждут свободного
+    места, а не накапливают задачи в памяти.
+
+    Ответы пользователей копятся в StatsBuffer и записываются пачкой раз в
+    flush_interval секунд или после flush_events ответов. Раз в
+    compact_interval секунд журнал ответов сворачивается в user_stats.
+    """
+
+    def __init__(self, db, max_pending_writes=1000, reader_threads=4,
+                 flush_interval=0.5, flush_events=500, compact_interval=3600):
+        self.db = db
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='db-reader')
+        self._write_slots = asyncio.Semaphore(max_pending_writes)
+        self.buffer = StatsBuffer()
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.compact_interval = compact_interval
+        self._flush_scheduled = False
+        self._flush_task = None
+        self._compact_task = None
+
+    async def _write(self, func, *args):
+        """Выполняет запись в потоке записи"""
+        async with self._write_slots:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    async def _read(self, func, *args):
+        """Выполняет чтение в пуле читающих потоков"""
+        return await asyncio.get_running_loop().run_in_executor(self._readers, func, *args)
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        await self._write(self.db.add_user, user_id, username, first_name, last_name)
+
+    async def update_user_stats(self, user_id, is_correct, operation_type=None):
+        if self.buffer.add(user_id, is_correct, operation_type) >= self.flush_events and not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().run_in_executor(self._writer, self._flush)
+
+    async def get_user_stats(self, user_id):
+        # Чтение идет через поток записи: пока оно выполняется, сброс буфера
+        # не может оказаться наполовину примененным
+        return await self._write(self._get_user_stats, user_id)
+
+    def _get_user_stats(self, user_id):
+        return self.db.get_user_stats(user_id, self.buffer.get(user_id))
+
+    def _flush(self):
+        """Записывает накопленные ответы (выполняется в потоке записи)"""
+        self._flush_scheduled = False
+        rows, log = self.buffer.drain()
+        if not rows:
+            return
+        try:
+            self.db.apply_stats_batch(rows, log)
+        except Exception as e:
+            logging.error(f"Ошибка при записи статистики: {e}")
+            self.buffer.restore(rows, log)
+
+    async def flush(self):
+        """Записывает накопленные ответы в базу"""
+        await self._write(self._flush)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def compact(self):
+        """Сворачивает старые события ответов в user_stats"""
+        removed = await self._write(self.db.compact_answer_events)
+        if removed:
+            logging.info(f"Журнал ответов сжат: свернуто событий {removed}")
+        return removed
+
+    async def _compact_periodically(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                logging.error(f"Ошибка при сжатии журнала ответов: {e}")
+            await asyncio.sleep(self.compact_interval)
+
+    def start(self):
+        """Запускает фоновые сброс буфера и сжатие журнала (вызывать внутри цикла событий)"""
+        loop = asyncio.get_running_loop()
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_periodically())
+        if self._compact_task is None:
+            self._compact_task = loop.create_task(self._compact_periodically())
+
+    async def get_summary_stats(self):
+        return await self._read(self.db.get_summary_stats)
+
+    async def get_top_users(self, limit=5):
+        return await self._read(self.db.get_top_users, limit)
+
+    async def get_recent_registrations(self, days=7):
+        return await self._read(self.db.get_recent_registrations, days)
+
+    async def rebuild_counters(self):
+        await self.flush()
+        return await self._write(self.db.rebuild_counters)
+
+    async def get_operation_stats(self):
+        return await self._read(self.db.get_operation_stats)
+
+    async def get_user_operation_stats(self, user_id):
+        return await self._read(self.db.get_user_operation_stats, user_id)
+
+    async def find_user(self, target):
+        return await self._read(self.db.find_user, target)
+
+    async def list_users(self, cursor=None, newer=False, limit=10):
+        return await self._read(self.db.list_users, cursor, newer, limit)
+
+    def close(self):
+        """Сбрасывает буфер, дожидается выполнения поставленных задач и закрывает соединения"""
+        for task in (self._flush_task, self._compact_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = self._compact_task = None
+        self._writer.submit(self._flush).result()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.db.pool.close()
@@ -0,0 +1,80 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# Сколько ID получателей приводить в сводке по каждой причине ошибки
+SAMPLE_RECIPIENTS = 5
+
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL):
+    """Переводит корневой логгер на очередь с фоновым потоком записи.
+
+    В цикле событий logging только кладет запись в очередь; форматирование
+    и запись в поток вывода выполняет QueueListener в отдельном потоке.
+    Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    # httpx пишет INFO на каждый запрос к Bot API - при рассылке это строка на получателя
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener.start()
+    # Дописываем оставшиеся в очереди записи при выходе
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class OutcomeLog:
+    """Сводка исходов по множеству получателей вместо строки на каждого.
+
+    record() только считает ошибку по причине и запоминает несколько ID
+    для примера; summary() раз в interval секунд (или принудительно в конце)
+    пишет одну строку на причину и обнуляет счетчики.
+    """
+
+    def __init__(self, title, interval=30.0, samples=SAMPLE_RECIPIENTS, logger=None):
+        self.title = title
+        self.interval = interval
+        self.samples = samples
+        self.logger = logger or logging.getLogger()
+        self._reasons = {}
+        self._logged_at = time.monotonic()
+
+    def record(self, recipient, reason):
+        entry = self._reasons.get(reason)
+        if entry is None:
+            entry = self._reasons[reason] = [0, []]
+        entry[0] += 1
+        if len(entry[1]) < self.samples:
+            entry[1].append(recipient)
+        self.summary()
+
+    def summary(self, force=False):
+        now = time.monotonic()
+        if not self._reasons or not force and now - self._logged_at < self.interval:
+            return
+        self._logged_at = now
+        for reason, (count, recipients) in sorted(self._reasons.items(), key=lambda item: -item[1][0]):
+            example = ', '.join(map(str, recipients))
+            self.logger.error(f"{self.title}: {count} x {reason} (например: {example})")
+        self._reasons.clear()
@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Порт HTTP-эндпоинта /metrics; если не задан, эндпоинт не запускается
+METRICS_PORT = os.environ.get('METRICS_PORT')
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Registry:
+    """Метрики с шардами по потокам.
+
+    Каждый поток пишет только в свой шард (словарь в threading.local), без
+    блокировок. При чтении /metrics шарды всех потоков суммируются. Словари
+    шардов копируются целиком (dict.copy атомарен под GIL), поэтому запись
+    в момент чтения не ломает обход.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(self, name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, collect):
+        """Показатель, который вычисляется при чтении: collect() -> [(метки, значение)]"""
+        self._gauges.append((name, help_text, collect))
+
+    def _collect(self):
+        """Сумма шардов: ключ (метрика, значения меток) -> значение или список"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals = {}
+        for shard in shards:
+            for key, value in shard.copy().items():
+                if isinstance(value, list):
+                    current = totals.get(key)
+                    if current is None:
+                        totals[key] = list(value)
+                    else:
+                        for i, item in enumerate(value):
+                            current[i] += item
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        totals = self._collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            series = sorted(
+                (key[1], value) for key, value in totals.items() if key[0] is metric
+            )
+            lines.extend(metric.render(series))
+        for name, help_text, collect in self._gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            try:
+                for labels, value in collect():
+                    lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}')
+            except Exception as e:
+                logging.error(f"Ошибка при сборе метрики {name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, registry, name, help_text, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, series):
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {value}' for labels, value in series]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.registry._shard()
+        key = (self, labels)
+        # Счетчики по корзинам (последняя - +Inf), затем сумма и количество
+        counts = shard.get(key)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 3)
+            shard[key] = counts
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self, series):
+        lines = []
+        names = self.labelnames + ('le',)
+        for labels, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {counts[-1]}')
+        return lines
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'mathbot_handler_seconds', 'Время выполнения обработчиков обновлений', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'mathbot_handler_errors_total', 'Исключения в обработчиках обновлений', ('handler',))
+DB_SECONDS = REGISTRY.histogram(
+    'mathbot_db_query_seconds', 'Время выполнения запросов к SQLite', ('query',))
+DB_ERRORS = REGISTRY.counter(
+    'mathbot_db_query_errors_total', 'Ошибки запросов к SQLite', ('query',))
+BROADCAST_MESSAGES = REGISTRY.counter(
+    'mathbot_broadcast_messages_total', 'Сообщения рассылок по результату', ('result',))
+
+
+def timed_query(func):
+    """Декоратор методов хранилищ: время и ошибки запроса под именем метода"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков замером времени"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+            if getattr(callback, '_instrumented', False):
+                continue
+            handler.callback = _timed_handler(callback)
+
+
+def _timed_handler(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+class MetricsServer:
+    """HTTP-эндпоинт GET /metrics в формате Prometheus"""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self._server = None
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self._server = await asyncio.start_server(self._handle_connection, host, int(port))
+        logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            method, target = head.decode('latin-1').split(' ', 2)[:2]
+            if method == 'GET' and target.partition('?')[0] == '/metrics':
+                # Сборка шардов может занять время при большом числе серий
+                body = (await asyncio.to_thread(self.registry.render)).encode()
+                status = '200 OK'
+            else:
+                body = b'Not Found\n'
+                status = '404 Not Found'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
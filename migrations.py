@@ -0,0 +1,342 @@
+import logging
+from database import DB_NAME, get_pool, recompute_counters
+
+
+def _base_tables(conn):
+    """Таблицы пользователей и статистики по сессиям"""
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            total_questions INTEGER DEFAULT 0,
+            correct_answers INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица статистики по сессиям
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            operation_type TEXT,
+            correct_answers INTEGER DEFAULT 0,
+            total_questions INTEGER DEFAULT 0,
+            session_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+
+def _announcements_table(conn):
+    """Таблица для отслеживания отправленных объявлений"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS announcements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            announcement_id TEXT UNIQUE,
+            user_id INTEGER,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+
+def _counters(conn):
+    """Агрегаты для админских отчетов, которые поддерживаются триггерами"""
+    # Глобальные счетчики - всегда ровно одна строка
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0,
+            total_questions INTEGER NOT NULL DEFAULT 0,
+            correct_answers INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Регистрации по дням
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_registrations (
+            date TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Триггеры обновляют агрегаты в той же транзакции, что и запись в users
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_counters_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE bot_counters
+            SET total_users = total_users + 1,
+                active_users = active_users + (NEW.total_questions > 0),
+                total_questions = total_questions + NEW.total_questions,
+                correct_answers = correct_answers + NEW.correct_answers
+            WHERE id = 1;
+            INSERT INTO daily_registrations (date, new_users)
+            VALUES (DATE(NEW.created_at), 1)
+            ON CONFLICT (date) DO UPDATE SET new_users = new_users + 1;
+        END
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_counters_update
+        AFTER UPDATE OF total_questions, correct_answers ON users
+        BEGIN
+            UPDATE bot_counters
+            SET active_users = active_users + (NEW.total_questions > 0) - (OLD.total_questions > 0),
+                total_questions = total_questions + NEW.total_questions - OLD.total_questions,
+                correct_answers = correct_answers + NEW.correct_answers - OLD.correct_answers
+            WHERE id = 1;
+        END
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_counters_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE bot_counters
+            SET total_users = total_users - 1,
+                active_users = active_users - (OLD.total_questions > 0),
+                total_questions = total_questions - OLD.total_questions,
+                correct_answers = correct_answers - OLD.correct_answers
+            WHERE id = 1;
+            UPDATE daily_registrations
+            SET new_users = new_users - 1
+            WHERE date = DATE(OLD.created_at);
+        END
+    ''')
+
+    # Для уже существующей базы счетчики считаются с нуля один раз
+    if conn.execute('INSERT OR IGNORE INTO bot_counters (id) VALUES (1)').rowcount:
+        recompute_counters(conn)
+
+
+def _indexes(conn):
+    """Индексы для админских отчетов и поиска пользователей"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_total_questions ON users (total_questions)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_user_id ON user_stats (user_id)')
+
+
+def _answer_events(conn):
+    """Журнал ответов и сводные строки по операциям в user_stats"""
+    # Сырые события: одна строка на ответ, живут до сжатия в user_stats
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS answer_events (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            operation_type TEXT NOT NULL,
+            is_correct INTEGER NOT NULL,
+            answered_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_answer_events_answered_at ON answer_events (answered_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_answer_events_user_id ON answer_events (user_id)')
+
+    # user_stats хранит свертку: одна строка на пользователя, операцию и день
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_stats_rollup
+        ON user_stats (user_id, operation_type, session_date)
+    ''')
+
+    # Глобальные счетчики по операциям для админских отчетов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS operation_counters (
+            operation_type TEXT PRIMARY KEY,
+            total_questions INTEGER NOT NULL DEFAULT 0,
+            correct_answers INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS answer_events_counters_insert AFTER INSERT ON answer_events
+        BEGIN
+            INSERT INTO operation_counters (operation_type, total_questions, correct_answers)
+            VALUES (NEW.operation_type, 1, NEW.is_correct)
+            ON CONFLICT (operation_type) DO UPDATE
+            SET total_questions = total_questions + 1,
+                correct_answers = correct_answers + NEW.is_correct;
+        END
+    ''')
+
+
+def _announcement_deliveries(conn):
+    """Доставки объявлений с составным ключом вместо announcements"""
+    # В announcements поле announcement_id было UNIQUE само по себе, поэтому
+    # записывался только первый получатель. Переносим то, что успело записаться.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS announcement_deliveries (
+            announcement_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (announcement_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO announcement_deliveries (announcement_id, user_id, sent_at)
+        SELECT announcement_id, user_id, sent_at
+        FROM announcements
+        WHERE announcement_id IS NOT NULL AND user_id IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE IF EXISTS announcements')
+
+
+def _broadcast_jobs(conn):
+    """Сохраняемые задания рассылки с курсором для продолжения после перезапуска"""
+    # job_id совпадает с announcement_id, cursor - последний обработанный user_id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id TEXT PRIMARY KEY,
+            message_text TEXT NOT NULL,
+            photo_path TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)')
+
+
+def _media_cache(conn):
+    """file_id загруженных в Telegram файлов по хэшу содержимого"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _backfill_last_active(conn):
+    """Последняя активность по журналу ответов и свернутой статистике
+
+    События старше срока хранения уже свернуты в user_stats с точностью до
+    дня, поэтому берется самое позднее из текущего значения, последнего
+    события журнала и последнего дня в user_stats.
+    """
+    conn.execute('''
+        UPDATE users
+        SET last_active_at = (
+            SELECT MAX(value) FROM (
+                SELECT users.last_active_at AS value
+                UNION ALL
+                SELECT MAX(answered_at) FROM answer_events AS e WHERE e.user_id = users.user_id
+                UNION ALL
+                SELECT DATETIME(MAX(session_date)) FROM user_stats AS s WHERE s.user_id = users.user_id
+            )
+        )
+    ''')
+
+
+def _reachability(conn):
+    """Недоступные пользователи, последняя активность и фильтры аудитории рассылок"""
+    conn.execute('ALTER TABLE users ADD COLUMN unreachable_at TIMESTAMP')
+    conn.execute('ALTER TABLE users ADD COLUMN unreachable_reason TEXT')
+    conn.execute('ALTER TABLE users ADD COLUMN last_active_at TIMESTAMP')
+
+    _backfill_last_active(conn)
+
+    # Частичные индексы содержат только доступных пользователей, поэтому
+    # выборка аудитории не читает заблокировавших бота
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_reachable
+        ON users (user_id) WHERE unreachable_at IS NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_reachable_active
+        ON users (last_active_at) WHERE unreachable_at IS NULL
+    ''')
+
+    conn.execute('ALTER TABLE broadcast_jobs ADD COLUMN active_since TEXT')
+    conn.execute('ALTER TABLE broadcast_jobs ADD COLUMN min_questions INTEGER')
+
+
+def _user_sessions(conn):
+    """Сохраненные context.user_data по пользователям"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            user_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _users_keyset_index(conn):
+    """Индекс для постраничного списка пользователей по (created_at, user_id)"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at_user_id ON users (created_at, user_id)')
+    # Старый индекс по created_at покрывается префиксом нового
+    conn.execute('DROP INDEX IF EXISTS idx_users_created_at')
+
+
+def _last_active_from_rollup(conn):
+    """Для баз, где миграция 9 учла только несжатый журнал ответов"""
+    _backfill_last_active(conn)
+
+
+# Порядок менять нельзя: номер версии записывается в schema_version.
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Таблицы пользователей и статистики', _base_tables),
+    (2, 'Таблица объявлений', _announcements_table),
+    (3, 'Агрегированные счетчики', _counters),
+    (4, 'Индексы users и user_stats', _indexes),
+    (5, 'Журнал ответов и свертка по операциям', _answer_events),
+    (6, 'Доставки объявлений с составным ключом', _announcement_deliveries),
+    (7, 'Задания рассылки', _broadcast_jobs),
+    (8, 'Кэш file_id медиафайлов', _media_cache),
+    (9, 'Доступность пользователей и фильтры аудитории', _reachability),
+    (10, 'Данные пользователей между перезапусками', _user_sessions),
+    (11, 'Индекс постраничного списка пользователей', _users_keyset_index),
+    (12, 'Последняя активность по свернутой статистике', _last_active_from_rollup),
+]
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы (0 - миграции еще не применялись)"""
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(db_name=DB_NAME):
+    """Применяет недостающие миграции и возвращает итоговую версию схемы"""
+    conn = get_pool(db_name).connection()
+
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    version = get_schema_version(conn)
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+
+        # BEGIN IMMEDIATE сразу берет блокировку записи: если миграции
+        # запущены параллельно, вторая дождется первой и увидит новую версию
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) < target:
+                apply(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                    (target, description)
+                )
+                logging.info(f"Применена миграция {target}: {description}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+
+    return version
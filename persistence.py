@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import logging
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from telegram.ext import BasePersistence, PersistenceInput
+from database import DB_NAME, get_pool
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение context.user_data в таблице user_sessions основной базы.
+
+    Данные пользователя читаются лениво, при первом обновлении от него
+    (refresh_user_data), а не все сразу при запуске. При сбросе пишутся
+    только изменившиеся пользователи, одной пачкой executemany в одной
+    транзакции. bot_data не сохраняется: там лежат соединения с базой и
+    другие объекты, которые живут только в процессе. chat_data, callback_data
+    и состояния диалогов боту не нужны и тоже не сохраняются.
+    """
+
+    def __init__(self, db_name=DB_NAME, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.pool = get_pool(db_name)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self._loaded = set()
+        # Хэш последней записанной версии, чтобы не переписывать неизменившееся
+        self._written = {}
+        self._dirty = {}
+        self._write_task = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load(self, user_id):
+        row = self.pool.connection().execute(
+            'SELECT data FROM user_sessions WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _save(self, rows, deleted):
+        with self.pool.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO user_sessions (user_id, data) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE
+                SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+            ''', rows)
+            conn.executemany('DELETE FROM user_sessions WHERE user_id = ?', [(user_id,) for user_id in deleted])
+
+    async def _write_dirty(self):
+        """Записывает накопленные изменения одной пачкой"""
+        # Пропускаем один шаг цикла: Application вызывает update_user_data для
+        # всех изменившихся пользователей сразу, и они попадают в одну пачку
+        await asyncio.sleep(0)
+        self._write_task = None
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+
+        rows = [(user_id, data) for user_id, data in dirty.items() if data is not None]
+        deleted = [user_id for user_id, data in dirty.items() if data is None]
+        try:
+            await self._run(self._save, rows, deleted)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении данных пользователей: {e}")
+            # Не затираем более свежие изменения, пришедшие во время записи
+            for user_id, data in dirty.items():
+                self._dirty.setdefault(user_id, data)
+                self._written.pop(user_id, None)
+            return
+        logging.debug(f"Сохранены данные пользователей: {len(rows)}, удалены: {len(deleted)}")
+
+    def _schedule_write(self):
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_dirty())
+
+    async def get_user_data(self):
+        # Данные загружаются по одному пользователю в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        data = await self._run(self._load, user_id)
+        self._loaded.add(user_id)
+        if data is not None:
+            self._written[user_id] = hashlib.blake2b(data, digest_size=16).digest()
+            user_data.update(pickle.loads(data))
+
+    async def update_user_data(self, user_id, data):
+        if not data:
+            # PTB вызывает метод для каждого пользователя из обновлений: пустые
+            # данные не записываем, а ранее сохраненную строку удаляем
+            if self._written.pop(user_id, None) is not None:
+                self._dirty[user_id] = None
+                self._schedule_write()
+            return
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if self._written.get(user_id) == digest:
+            return
+        self._written[user_id] = digest
+        self._dirty[user_id] = payload
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(user_id, None)
+        self._loaded.discard(user_id)
+        self._dirty[user_id] = None
+        self._schedule_write()
+
+    async def flush(self):
+        """Записывает все накопленные изменения (вызывается при остановке)"""
+        if self._write_task is not None:
+            await self._write_task
+        if self._dirty:
+            await self._write_dirty()
+        self._executor.shutdown(wait=True)
+
+    # Остальные данные не сохраняются
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Ограничения длительности профилирования по команде /profile, секунды
+MAX_PROFILE_SECONDS = 120
+SAMPLE_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик всех потоков процесса.
+
+    Фоновый поток раз в interval секунд снимает стеки всех потоков через
+    sys._current_frames() и считает, какие функции были на вершине стека
+    (собственное время) и где-либо в стеке (суммарное время). Код
+    приложения не трассируется, поэтому накладные расходы ограничены
+    самим сэмплированием и есть только пока профилировщик запущен.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.own = Counter()
+        self.total = Counter()
+        self.threads = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _location(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            self.threads[names.get(thread_id, str(thread_id))] += 1
+            self.own[self._location(frame)] += 1
+            seen = set()
+            while frame is not None:
+                location = self._location(frame)
+                if location not in seen:
+                    seen.add(location)
+                    self.total[location] += 1
+                frame = frame.f_back
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, limit=30):
+        lines = [f"Сэмплов: {self.samples} (интервал {self.interval * 1000:.0f} мс)", ""]
+        for title, counter in (("Собственное время (вершина стека)", self.own),
+                               ("Суммарное время (функция в стеке)", self.total)):
+            lines.append(f"== {title} ==")
+            for location, count in counter.most_common(limit):
+                lines.append(f"{count / max(self.samples, 1):7.1%}  {count:6}  {location}")
+            lines.append("")
+        lines.append("== Потоки ==")
+        for name, count in self.threads.most_common():
+            lines.append(f"{count:6}  {name}")
+        return '\n'.join(lines)
+
+
+_profile_lock = asyncio.Lock()
+
+
+def is_profiling():
+    return _profile_lock.locked()
+
+
+async def profile(seconds, limit=30):
+    """Профилирует процесс seconds секунд и возвращает текстовый отчет
+
+    Одновременно работает только один профиль. tracemalloc включается на
+    время профиля, если не был включен раньше, и выключается после снимка.
+    """
+    async with _profile_lock:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+        profiler = SamplingProfiler()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+        elapsed = time.perf_counter() - started
+
+        # Снимки и сортировка статистики занимают заметное время - не в цикле событий
+        def build_report():
+            # Выделения самого профилировщика в отчете не нужны
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            snapshot = after.filter_traces(filters)
+            lines = [f"Профиль процесса {os.getpid()} за {elapsed:.1f} с", "", profiler.report(limit), ""]
+            lines.append("== Выделения памяти за время профиля (по строкам) ==")
+            lines.append(f"Отслеживается сейчас: {current / 1024:.0f} КиБ, пик: {peak / 1024:.0f} КиБ")
+            for stat in snapshot.compare_to(before.filter_traces(filters), 'lineno')[:limit]:
+                lines.append(str(stat))
+            lines.append("")
+            lines.append("== Крупнейшие места выделения памяти ==")
+            for stat in snapshot.statistics('lineno')[:limit]:
+                lines.append(str(stat))
+            return '\n'.join(lines)
+
+        return await asyncio.to_thread(build_report)
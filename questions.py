@@ -0,0 +1,145 @@
+import random
+import threading
+from collections import deque
+
+import numpy as np
+
+OPERATIONS = ("addition", "subtraction", "multiplication", "division")
+
+SYMBOLS = {
+    "addition": "+",
+    "subtraction": "-",
+    "multiplication": "×",
+    "division": "÷",
+}
+
+# Неправильные ответы отличаются от правильного на 1-3 в любую сторону
+OFFSETS = np.array([-3, -2, -1, 1, 2, 3])
+
+
+def generate_operands(operation_type, size, rng):
+    """Операнды и правильные ответы для size вопросов одного типа"""
+    if operation_type == "addition":
+        # Сложение: числа от 1 до 500
+        a = rng.integers(1, 501, size)
+        b = rng.integers(1, 501, size)
+        answer = a + b
+
+    elif operation_type == "subtraction":
+        # Вычитание: гарантируем положительный результат
+        a = rng.integers(10, 251, size)
+        b = rng.integers(1, a)
+        answer = a - b
+
+    elif operation_type == "multiplication":
+        # Умножение: числа от 2 до 15
+        a = rng.integers(2, 16, size)
+        b = rng.integers(2, 16, size)
+        answer = a * b
+
+    elif operation_type == "division":
+        # Деление: гарантируем целый результат
+        b = rng.integers(2, 16, size)
+        answer = rng.integers(2, 16, size)
+        a = b * answer  # a кратно b
+
+    else:
+        raise ValueError(f"Неизвестный тип операции: {operation_type}")
+
+    return a, b, answer
+
+
+def generate_batch(operation_type, size, rng):
+    """Генерирует size вопросов одного типа векторно
+
+    Неправильные ответы - три разных положительных числа из answer ± 1..3,
+    порядок всех четырех вариантов случайный.
+    """
+    a, b, answer = generate_operands(operation_type, size, rng)
+
+    # Выбираем 3 разных смещения из 6: сортируем случайные ключи, а смещения,
+    # дающие неположительный ответ, отодвигаем в конец ключом 2
+    candidates = answer[:, None] + OFFSETS
+    keys = rng.random((size, len(OFFSETS)))
+    keys[candidates <= 0] = 2
+    chosen = np.argsort(keys, axis=1)[:, :3]
+    wrong_answers = np.take_along_axis(candidates, chosen, axis=1)
+
+    # Перемешиваем правильный ответ с неправильными
+    all_answers = np.column_stack([wrong_answers, answer])
+    order = np.argsort(rng.random((size, 4)), axis=1)
+    all_answers = np.take_along_axis(all_answers, order, axis=1)
+
+    symbol = SYMBOLS[operation_type]
+    return [
+        {
+            "question": f"{x} {symbol} {y}",
+            "correct_answer": correct,
+            "all_answers": answers,
+            "operation_type": operation_type
+        }
+        for x, y, correct, answers in zip(a.tolist(), b.tolist(), answer.tolist(), all_answers.tolist())
+    ]
+
+
+class QuestionPool:
+    """Заранее сгенерированные вопросы в кольцевых буферах по типам операций.
+
+    Вопросы выдаются из буфера за O(1). Когда в буфере остается меньше
+    low_watermark вопросов, новая пачка генерируется в фоновом потоке.
+    """
+
+    def __init__(self, batch_size=4096, low_watermark=1024, seed=None):
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self._rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()
+        self._buffers = {operation_type: deque() for operation_type in OPERATIONS}
+        self._refilling = set()
+        self._refilling_lock = threading.Lock()
+
+    def _refill(self, operation_type):
+        # Генератор numpy не потокобезопасен
+        with self._rng_lock:
+            batch = generate_batch(operation_type, self.batch_size, self._rng)
+        self._buffers[operation_type].extend(batch)
+
+    def _refill_in_background(self, operation_type):
+        with self._refilling_lock:
+            if operation_type in self._refilling:
+                return
+            self._refilling.add(operation_type)
+
+        def refill():
+            try:
+                self._refill(operation_type)
+            finally:
+                with self._refilling_lock:
+                    self._refilling.discard(operation_type)
+
+        threading.Thread(target=refill, name=f"questions-{operation_type}", daemon=True).start()
+
+    def warm_up(self):
+        """Заполняет все буферы заранее"""
+        for operation_type in OPERATIONS:
+            self._refill(operation_type)
+
+    def get(self, operation_type):
+        """Следующий вопрос указанного типа ("random" - случайный тип)"""
+        if operation_type == "random":
+            operation_type = random.choice(OPERATIONS)
+        if operation_type not in self._buffers:
+            raise ValueError(f"Неизвестный тип операции: {operation_type}")
+
+        buffer = self._buffers[operation_type]
+        while True:
+            try:
+                question = buffer.popleft()
+                break
+            except IndexError:
+                # Фоновое пополнение не успело - генерируем сами
+                self._refill(operation_type)
+
+        if len(buffer) < self.low_watermark:
+            self._refill_in_background(operation_type)
+        return question
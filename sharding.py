@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from queue import Empty
+from telegram import Bot, Update
+from migrations import migrate
+from api_request import api_urls
+from metrics import METRICS_PORT
+from webhook import WebhookServer
+
+# Число рабочих процессов; 1 - обычный режим в одном процессе
+WORKERS = int(os.environ.get('WORKERS', 1))
+
+
+def update_user_id(data):
+    """user_id (или chat_id) из сырого обновления без разбора в объекты PTB"""
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user') or value.get('chat')
+            if sender:
+                return sender['id']
+            message = value.get('message')
+            if message:
+                return message['chat']['id']
+    return None
+
+
+class ShardRouter:
+    """Распределяет сырые обновления по очередям рабочих процессов.
+
+    Обновления одного пользователя всегда попадают в один процесс
+    (user_id % число процессов), поэтому буфер статистики и кэш принятых
+    ответов пользователя живут в одном месте. Обновления без пользователя
+    уходят в процесс 0.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def route(self, data):
+        user_id = update_user_id(data)
+        shard = user_id % len(self.queues) if user_id is not None else 0
+        self.queues[shard].put(data)
+        return shard
+
+    async def dispatch(self, data):
+        self.route(data)
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+
+
+def _next_update(queue):
+    """Следующее обновление из очереди или None, если входной процесс завершился без None"""
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+
+async def serve_queue(application, queue, on_started=None):
+    """Передает обновления из очереди процесса в приложение до получения None"""
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if on_started:
+            on_started()
+        while True:
+            data = await loop.run_in_executor(None, _next_update, queue)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        # stop() дожидается обработки всех уже полученных обновлений
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def worker_main(token, index, queue, request_factory=None, done=None):
+    """Точка входа рабочего процесса
+
+    request_factory - необязательный конструктор транспорта Bot API.
+    Для бенчмарков в done кладутся ('started', index, время) после запуска
+    и ('done', index, время) после обработки всех обновлений.
+    """
+    from bot import MathBot
+
+    # Остановка приходит от входного процесса через очередь. SIGINT и SIGTERM
+    # часто получает вся группа процессов (Ctrl+C, systemd, Heroku) - рабочий
+    # процесс их игнорирует и завершается штатно после None, сохранив
+    # накопленную статистику и данные пользователей
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    request = request_factory() if request_factory else None
+    # У каждого процесса свои метрики на порту METRICS_PORT + index
+    metrics_port = int(METRICS_PORT) + index if METRICS_PORT else None
+    bot = MathBot(token, request=request, use_updater=False, resume_broadcasts=index == 0,
+                  metrics_port=metrics_port)
+    on_started = (lambda: done.put(('started', index, time.time()))) if done is not None else None
+    asyncio.run(serve_queue(bot.application, queue, on_started))
+    if done is not None:
+        done.put(('done', index, time.time()))
+
+
+def start_workers(token, workers, request_factory=None, done=None):
+    """Запускает рабочие процессы и возвращает (процессы, ShardRouter)"""
+    # Схему обновляем до запуска процессов, чтобы они не ждали друг друга
+    migrate()
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(
+            target=worker_main, args=(token, index, queue, request_factory, done),
+            name=f'math-bot-worker-{index}', daemon=True
+        )
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+    return processes, ShardRouter(queues)
+
+
+async def _poll(bot, router, stop):
+    """Получение обновлений long polling во входном процессе"""
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=10, allowed_updates=Update.ALL_TYPES)
+        except Exception as e:
+            logging.warning(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            router.route(update.to_dict())
+            offset = update.update_id + 1
+
+
+async def run_ingress(token, router, webhook_config=None):
+    """Входной процесс: получает обновления и раздает их по рабочим процессам"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with Bot(token, **api_urls()) as bot:
+        if webhook_config:
+            server = WebhookServer(
+                None, webhook_config['path'], webhook_config['secret_token'],
+                webhook_config['max_body_size'], dispatch=router.dispatch
+            )
+            await server.start(webhook_config['host'], webhook_config['port'])
+            await bot.set_webhook(
+                webhook_config['url'],
+                secret_token=webhook_config['secret_token'],
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=webhook_config['max_connections'],
+            )
+            try:
+                await stop.wait()
+            finally:
+                await server.stop()
+        else:
+            poller = asyncio.create_task(_poll(bot, router, stop))
+            await stop.wait()
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+
+
+def run_sharded(token, workers=WORKERS, webhook_config=None):
+    """Запуск бота в режиме шардинга: один входной процесс и workers рабочих"""
+    processes, router = start_workers(token, workers)
+    logging.info(f"Запущено рабочих процессов: {workers}")
+    try:
+        asyncio.run(run_ingress(token, router, webhook_config))
+    finally:
+        router.stop()
+        for process in processes:
+            process.join()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько обновлений обрабатывается одновременно по умолчанию
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', 64))
+# Лимит семафора базового класса: фактически без ограничения
+UNLIMITED_UPDATES = 2 ** 30
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates), обновления одного пользователя - строго по
+    очереди: быстрые нажатия двух кнопок ответа не обрабатываются
+    параллельно. Блокировка пользователя удаляется, когда его очередь пуста,
+    поэтому словарь блокировок не растет с числом пользователей.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        # Семафор базового класса берется до do_process_update, то есть до
+        # блокировки пользователя: обновление, ждущее своей очереди, занимало
+        # бы место в лимите. Поэтому базовый лимит снят, а настоящий
+        # ограничивает собственный семафор, который берется после блокировки.
+        super().__init__(UNLIMITED_UPDATES)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # user_id -> [блокировка, число ожидающих и выполняемых обновлений]
+        self._locks = {}
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # Сначала очередь пользователя (asyncio.Lock пропускает ожидающих
+            # по порядку), потом общий лимит: поток нажатий одного
+            # пользователя не задерживает остальных
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
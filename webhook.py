@@ -0,0 +1,220 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+from telegram import Update
+
+# Telegram присылает обновления до нескольких сотен килобайт, больше не принимаем
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+# Сколько секунд держим открытым простаивающее keep-alive соединение
+KEEPALIVE_TIMEOUT = 75
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+}
+
+
+def webhook_config_from_env():
+    """Настройки вебхука из окружения или None, если бот работает через polling
+
+    WEBHOOK_URL - публичный адрес, который регистрируется в Telegram;
+    WEBHOOK_SECRET - секрет для заголовка X-Telegram-Bot-Api-Secret-Token;
+    WEBHOOK_LISTEN и PORT - адрес и порт локального сервера;
+    WEBHOOK_PATH - путь запросов (по умолчанию путь из WEBHOOK_URL).
+    """
+    url = os.environ.get('WEBHOOK_URL')
+    if not url:
+        return None
+
+    path = os.environ.get('WEBHOOK_PATH')
+    if path is None:
+        path = '/' + url.split('://', 1)[-1].partition('/')[2]
+    return {
+        'url': url,
+        'path': path,
+        'secret_token': os.environ.get('WEBHOOK_SECRET'),
+        'host': os.environ.get('WEBHOOK_LISTEN', '0.0.0.0'),
+        'port': int(os.environ.get('PORT', 8443)),
+        'max_body_size': int(os.environ.get('WEBHOOK_MAX_BODY_SIZE', MAX_BODY_SIZE)),
+        'max_connections': int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40)),
+    }
+
+
+class WebhookServer:
+    """Минимальный HTTP/1.1 сервер на asyncio для приема обновлений от Telegram.
+
+    Принимает только POST на path с JSON-телом не больше max_body_size байт
+    и, если задан secret_token, с совпадающим заголовком
+    X-Telegram-Bot-Api-Secret-Token. Обновление кладется в update_queue
+    приложения (или передается в dispatch(data), если он задан), ответ 200
+    отправляется сразу, не дожидаясь обработчиков.
+    Соединения держатся открытыми (keep-alive) до keepalive_timeout секунд
+    простоя.
+    """
+
+    def __init__(self, application, path='/', secret_token=None,
+                 max_body_size=MAX_BODY_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT, dispatch=None):
+        self.application = application
+        self.dispatch = dispatch or self._enqueue
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body_size = max_body_size
+        self.keepalive_timeout = keepalive_timeout
+        self._server = None
+        self._connections = set()
+
+    @property
+    def port(self):
+        """Фактический порт сервера (полезно при port=0)"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host='0.0.0.0', port=8443):
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, limit=MAX_HEADER_SIZE
+        )
+        logging.info(f"Вебхук слушает {host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout
+                    )
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 431, keep_alive=False)
+                    break
+
+                try:
+                    status, keep_alive = await self._handle_request(head, reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    # Неожиданная ошибка разбора не должна оставлять клиента без ответа
+                    logging.warning(f"Ошибка обработки запроса вебхука: {e!r}")
+                    status, keep_alive = 400, False
+                await self._respond(writer, status, keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _handle_request(self, head, reader):
+        """Разбирает один запрос и возвращает (код ответа, оставить ли соединение)"""
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            return 400, False
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+        if 'transfer-encoding' in headers:
+            return 411, False
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return 400, False
+        if length < 0:
+            return 400, False
+        if length > self.max_body_size:
+            # Тело не читаем, поэтому соединение дальше использовать нельзя
+            return 413, False
+        body = await reader.readexactly(length)
+
+        if target.partition('?')[0] != self.path:
+            return 404, keep_alive
+        if method != 'POST':
+            return 405, keep_alive
+        # compare_digest не принимает строки с не-ASCII символами - сравниваем байты
+        if self.secret_token is not None and not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', '').encode('latin-1'),
+                self.secret_token.encode()):
+            return 403, keep_alive
+
+        try:
+            data = json.loads(body)
+            await self.dispatch(data)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return 400, keep_alive
+        return 200, keep_alive
+
+    async def _enqueue(self, data):
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    async def _respond(self, writer, status, keep_alive):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+
+async def run_webhook(application, config):
+    """Запускает приложение в режиме вебхука до SIGINT/SIGTERM
+
+    Повторяет жизненный цикл run_polling: post_init, start, ожидание
+    сигнала, stop, shutdown и post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(
+        application, config['path'], config['secret_token'], config['max_body_size']
+    )
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start(config['host'], config['port'])
+        await application.bot.set_webhook(
+            config['url'],
+            secret_token=config['secret_token'],
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=config['max_connections'],
+        )
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)